@@ -5,26 +5,54 @@
 # correspond to.<br>
 # Every function aborts the program if it requires a different mode. For instance, if the function
 # _writebit() is called with Bitstream on READ mode. 
+# In WRITE mode the bits are packed into an in-memory accumulator and only written to the file in
+# large chunks, keeping the resulting file byte-identical to writing it one byte at a time.
+# In READ mode the file is memory-mapped and bits are served from a 64-bit window, which also
+# allows looking ahead (peek), skipping bits and reading whole runs of 1's (read_unary) at once.
+# Golomb codes can be written and read directly (write_golomb/read_golomb), without strings, and
+# whole arrays of values can be Golomb coded and packed at once (write_golomb_array) or decoded in a
+# single loop (read_golomb_array), as well as arrays of flags (write_bit_array/read_bit_array).
+# Both modes can align to byte boundaries and report/move to byte offsets (align, tell, seek,
+# writeBytes), so that independently coded segments can be concatenated and located, and bytes
+# already written can be overwritten (writeAt). In WRITE mode an already open binary file object
+# (such as io.BytesIO) can be given instead of a file name.
 # @author Tiago Melo 89005
 # @author João Nogueira 89262 
 
+import mmap
+import numpy as np
+
 class BitStream:
-    def __init__(self, f, mode):
+    def __init__(self, f, mode, bufferSize=1<<20):
         ## Initialization function
-        # @param[in] file_name Name of the file that is going to be manipulated
+        # @param[in] file_name Name of the file that is going to be manipulated (or binary file object, in WRITE mode)
         # @param[in] mode Mode of manipulation (write/read)
+        # @param[in] bufferSize Number of packed bytes kept in memory before writing them to the file
         self.mode = mode
 
         if mode == "READ":
             self.input = open(f, "rb")
+            try:
+                self.data = mmap.mmap(self.input.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:   # empty files cannot be mapped
+                self.data = self.input.read()
         elif mode == "WRITE":
-            self.out = open(f, "wb")
+            if hasattr(f, "write"):
+                self.out = f
+            else:
+                self.out = open(f, "wb")
 
+        # Pending bits (write_bcount of them) and bytes already packed but not yet written
         self.write_accumulator = 0
         self.write_bcount = 0
+        self.write_buffer = bytearray()
+        self.bufferSize = bufferSize
+        self.write_offset = 0
 
+        # Bit window (read_bcount valid bits) and position of the next byte to load into it
         self.read_accumulator = 0
         self.read_bcount = 0
+        self.read_pos = 0
         self.read = 0
 
     def __enter__(self):
@@ -45,45 +73,232 @@ class BitStream:
     ## Write a single bit to self.file_name
     # @param[in] value of the bit to be written to a file
     def _writebit(self, bit):
-        if self.write_bcount == 8:
-            self.flush()
-        if bit > 0:
-            self.write_accumulator |= 1 << 7-self.write_bcount
-        self.write_bcount += 1
+        self.writebits(1 if bit > 0 else 0, 1)
 
 
     ## Read a single bit from file
     # @param[out] value of the bit read 
     def _readbit(self):
         if not self.read_bcount:
-            a = self.input.read(1)
-            if a:
-                self.read_accumulator = ord(a)
-            self.read_bcount = 8
-            self.read = len(a)
-        rv = (self.read_accumulator & (1 << self.read_bcount-1)) >> self.read_bcount-1
+            self._refill(1)
         self.read_bcount -= 1
+        rv = self.read_accumulator >> self.read_bcount
+        self.read_accumulator &= (1 << self.read_bcount) - 1
         return rv
 
 
+    ## Load 64 bits at a time into the read window until it holds at least N bits
+    # @param[in] nbits Number of bits that must be available
+    # Reading past the end of the file yields 0's
+    def _refill(self, nbits):
+        while self.read_bcount < nbits:
+            chunk = self.data[self.read_pos:self.read_pos+8]
+            self.read = len(chunk)
+            self.read_pos += 8
+            self.read_accumulator = (self.read_accumulator << 64) | (int.from_bytes(chunk, 'big') << 8*(8-len(chunk)))
+            self.read_bcount += 64
+
+
+    ## Look at the next N bits without consuming them
+    # @param[in] nbits Number of bits to look at
+    # @param[out] value of the next nbits bits
+    def peek(self, nbits):
+        if self.read_bcount < nbits:
+            self._refill(nbits)
+        return self.read_accumulator >> (self.read_bcount - nbits)
+
+
+    ## Consume the next N bits without decoding them
+    # @param[in] nbits Number of bits to skip
+    def skip(self, nbits):
+        if nbits > self.read_bcount:
+            nbits -= self.read_bcount
+            self.read_pos += nbits // 8
+            self.read_accumulator = 0
+            self.read_bcount = 0
+            nbits %= 8
+            self._refill(nbits)
+        self.read_bcount -= nbits
+        self.read_accumulator &= (1 << self.read_bcount) - 1
+
+
+    ## Read a unary code, a run of 1's terminated by a 0
+    # @param[out] count Number of 1's read (the terminating 0 is also consumed)
+    # The window is scanned as a whole, so a run costs one operation per 64 bits instead of one per bit
+    def read_unary(self):
+        count = 0
+        while True:
+            if not self.read_bcount:
+                self._refill(1)
+            zeros = self.read_accumulator ^ ((1 << self.read_bcount) - 1)
+            if zeros:
+                size = zeros.bit_length()
+                count += self.read_bcount - size
+                self.read_bcount = size - 1
+                self.read_accumulator &= (1 << self.read_bcount) - 1
+                return count
+            count += self.read_bcount
+            self.read_accumulator = 0
+            self.read_bcount = 0
+
+
+    ## Write a value using Golomb code
+    # @param[in] value Value to be written
+    # @param[in] g Golomb class object
+    # @param[in] signed Flag indicating if a sign bit (1 if negative) is written before the code
+    def write_golomb(self, value, g, signed=True):
+        if signed and value < 0:
+            code, length = g.encodeBits(-value)
+            self.writebits(code | 1 << length, length + 1)
+        else:
+            code, length = g.encodeBits(value)
+            self.writebits(code, length + signed)
+
+
+    ## Write every value of an array using Golomb code
+    # @param[in] values Array of values to be written (in the order given by ravel())
+    # @param[in] g Golomb class object
+    # @param[in] signed Flag indicating if a sign bit (1 if negative) is written before each code
+    # Writes the same bits as calling write_golomb() for each value, but the codes are computed
+    # and packed into bytes with a handful of NumPy operations
+    def write_golomb_array(self, values, g, signed=True):
+        bits = g.encodeArray(values, signed)
+        if self.write_bcount:
+            self._pack()
+            pending = np.unpackbits(np.array([self.write_accumulator << (8 - self.write_bcount)], dtype=np.uint8))
+            bits = np.concatenate((pending[:self.write_bcount], bits))
+        if not len(bits):
+            return
+
+        nbytes = (len(bits) - 1) // 8
+        self.write_buffer += np.packbits(bits[:8*nbytes]).tobytes()
+        self.write_bcount = len(bits) - 8*nbytes
+        self.write_accumulator = int(np.packbits(bits[8*nbytes:])[0]) >> (8 - self.write_bcount)
+        if len(self.write_buffer) >= self.bufferSize:
+            self._writeBuffer()
+
+
+    ## Read a value written using Golomb code
+    # Most codes are resolved with a single lookup of the next bits in the Golomb decoding table
+    # @param[in] g Golomb class object
+    # @param[in] signed Flag indicating if the code is preceded by a sign bit
+    # @param[out] value Decoded value
+    def read_golomb(self, g, signed=True):
+        table = g.tables[signed]
+        if table is None:
+            table = g.decodeTable(signed)
+        if self.read_bcount < g.tableBits:
+            self._refill(g.tableBits)
+        entry = table[self.read_accumulator >> (self.read_bcount - g.tableBits)]
+        if entry is not None:
+            self.read_bcount -= entry[1]
+            self.read_accumulator &= (1 << self.read_bcount) - 1
+            return entry[0]
+
+        # code longer than the decoding table window
+        negative = signed and self.read_n_bits(1)
+        value = g.factor*self.read_unary()
+        rest = self.read_n_bits(g.remainderBits)
+        if rest >= g.cutoff:
+            rest = (rest << 1 | self.read_n_bits(1)) - g.cutoff
+        value += rest
+        if negative:
+            return -value
+        return value
+
+
+    ## Read N values written using Golomb code
+    # @param[in] count Number of values to read
+    # @param[in] g Golomb class object
+    # @param[in] signed Flag indicating if each code is preceded by a sign bit
+    # @param[out] values NumPy array with the decoded values
+    # Same as calling read_golomb() count times, with the bit window kept in local variables
+    def read_golomb_array(self, count, g, signed=True):
+        table = g.tables[signed]
+        if table is None:
+            table = g.decodeTable(signed)
+        nbits = g.tableBits
+        mask = (1 << nbits) - 1
+        data = self.data
+
+        acc = self.read_accumulator
+        bcount = self.read_bcount
+        pos = self.read_pos
+        values = [0]*count
+        for i in range(0, count):
+            if bcount < nbits:
+                chunk = data[pos:pos+8]
+                pos += 8
+                acc = ((acc & ((1 << bcount) - 1)) << 64) | (int.from_bytes(chunk, 'big') << 8*(8-len(chunk)))
+                bcount += 64
+            entry = table[(acc >> (bcount - nbits)) & mask]
+            if entry is None:
+                # code longer than the decoding table window
+                self.read_accumulator, self.read_bcount, self.read_pos = acc & ((1 << bcount) - 1), bcount, pos
+                values[i] = self.read_golomb(g, signed)
+                acc, bcount, pos = self.read_accumulator, self.read_bcount, self.read_pos
+                continue
+            values[i] = entry[0]
+            bcount -= entry[1]
+
+        self.read_accumulator = acc & ((1 << bcount) - 1)
+        self.read_bcount = bcount
+        self.read_pos = pos
+        return np.array(values, dtype=np.int64)
+
+
     ## Write N bits to file
     # @param[in] bits to be written to a file
     # @param[in] number of bits to be written
+    # The whole codeword is appended to the accumulator in one operation, full bytes are
+    # moved to the write buffer once the accumulator grows past a few hundred bits
     def writebits(self, bits, n):
-        while n > 0:
-            self._writebit(bits & 1 << n-1)
-            n -= 1
+        self.write_accumulator = (self.write_accumulator << n) | (bits & ((1 << n) - 1))
+        self.write_bcount += n
+        if self.write_bcount >= 2048:
+            self._pack()
+
+
+    ## Move the complete bytes of the accumulator to the write buffer
+    # Like the original per-bit writer, the last 1 to 8 bits are kept pending until the next write
+    # Writes the buffer to the file when it reaches bufferSize bytes
+    def _pack(self):
+        nbytes, rest = divmod(self.write_bcount - 1, 8)
+        rest += 1
+        self.write_buffer += (self.write_accumulator >> rest).to_bytes(nbytes, 'big')
+        self.write_accumulator &= (1 << rest) - 1
+        self.write_bcount = rest
+        if len(self.write_buffer) >= self.bufferSize:
+            self._writeBuffer()
  
 
     ## Read N bits from a file
     # @param[in] number of bits to be read from a file
     # @param[out] values of bits read from file
     def readbits(self, n):
-        chars = []
-        for i in range(0, n):
-            chars.append(str(self._readbit()))
+        if n <= 0:
+            return ''
+        return format(self.read_n_bits(n), '0' + str(n) + 'b')
+
 
-        return ''.join(chars)
+    ## Write an array of bits (flags) to file
+    # @param[in] bits NumPy array of 0's and 1's
+    # All the bits are appended to the accumulator in one operation
+    def write_bit_array(self, bits):
+        n = len(bits)
+        if n:
+            value = int.from_bytes(np.packbits(np.asarray(bits, dtype=np.uint8)).tobytes(), 'big')
+            self.writebits(value >> (-n % 8), n)
+
+
+    ## Read an array of bits (flags) from file
+    # @param[in] count Number of bits to read
+    # @param[out] bits NumPy array of 0's and 1's
+    def read_bit_array(self, count):
+        if count == 0:
+            return np.zeros(shape=0, dtype=np.uint8)
+        value = self.read_n_bits(count) << (-count % 8)
+        return np.unpackbits(np.frombuffer(value.to_bytes((count+7)//8, 'big'), dtype=np.uint8))[:count]
 
 
     ## Write a given value using a certain number of bits to a file
@@ -99,11 +314,7 @@ class BitStream:
             print("Error: Cannot write "+str(value)+" with as little as " + str(nbits) + " bits")
             exit(0)
 
-        for i in range(nbits-1, -1, -1):
-            if i >= len(b):
-                self._writebit(0)
-            else:
-                self.writebits(int(b[len(b) - i - 1], 2), 1)
+        self.writebits(value, nbits)
 
 
     ## Read the value corresponding to the next N bits of the file
@@ -112,19 +323,89 @@ class BitStream:
         if self.mode != "READ":
             print("ERROR: Unsupported operation given the current mode (WRITE)")
             exit(1)
-        v = 0
-        while nbits > 0:
-            v = (v << 1) | self._readbit()
-            nbits -= 1
+        if self.read_bcount < nbits:
+            self._refill(nbits)
+        self.read_bcount -= nbits
+        v = self.read_accumulator >> self.read_bcount
+        self.read_accumulator &= (1 << self.read_bcount) - 1
         return v
 
 
     ## Auxiliary function to the write operations
     # Writes the packaged bits to a file
+    # The last incomplete byte is padded with 0's, and as before a byte is always written even
+    # if there are no pending bits
     def flush(self):
-        self.out.write(bytearray([self.write_accumulator]))
+        nbits = self.write_bcount or 8
+        pad = -nbits % 8
+        self.write_buffer += (self.write_accumulator << pad).to_bytes((nbits + pad) // 8, 'big')
         self.write_accumulator = 0
         self.write_bcount = 0
+        self._writeBuffer()
+
+
+    ## Write the packed bytes to the file
+    def _writeBuffer(self):
+        self.out.write(self.write_buffer)
+        self.write_offset += len(self.write_buffer)
+        self.write_buffer = bytearray()
+
+
+    ## Move to the next byte boundary
+    # In WRITE mode the last byte is completed with 0's, in READ mode the rest of the current byte is skipped
+    def align(self):
+        if self.mode == "WRITE":
+            if self.write_bcount % 8:
+                self.writebits(0, 8 - self.write_bcount % 8)
+        else:
+            self.skip(self.read_bcount % 8)
+
+
+    ## Position in the file
+    # @param[out] offset Number of bytes written or read so far (the position must be at a byte boundary)
+    def tell(self):
+        if self.mode == "WRITE":
+            return self.write_offset + len(self.write_buffer) + self.write_bcount // 8
+        return self.read_pos - self.read_bcount // 8
+
+
+    ## Move to a byte offset of the file (READ mode)
+    # @param[in] offset Number of bytes from the beginning of the file
+    def seek(self, offset):
+        self.read_pos = offset
+        self.read_accumulator = 0
+        self.read_bcount = 0
+
+
+    ## Write a sequence of bytes (WRITE mode)
+    # @param[in] data Bytes to be written, starting at the next byte boundary
+    # As with any other write, the last byte is kept pending until the next write or flush
+    def writeBytes(self, data):
+        self.align()
+        if not len(data):
+            return
+        if self.write_bcount:
+            self.write_buffer += self.write_accumulator.to_bytes(self.write_bcount // 8, 'big')
+        self.write_buffer += data[:-1]
+        self.write_accumulator = data[-1]
+        self.write_bcount = 8
+        if len(self.write_buffer) >= self.bufferSize:
+            self._writeBuffer()
+
+
+    ## Overwrite bytes already written (WRITE mode, seekable files only)
+    # @param[in] offset Byte offset of the first byte to overwrite
+    # @param[in] data New bytes
+    # Used to fill in fields that are only known at the end, such as the number of frames of a stream
+    def writeAt(self, offset, data):
+        self._writeBuffer()
+        if offset + len(data) > self.write_offset:
+            print("Error: Cannot overwrite bytes that were not written yet")
+            exit(1)
+        position = self.out.tell()
+        self.out.seek(offset)
+        self.out.write(data)
+        self.out.seek(position)
 
 
     ## Close files
@@ -137,11 +418,12 @@ class BitStream:
         if self.mode == "WRITE":
             self.out.close()
         elif self.mode == "READ":
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
             self.input.close()
     
     ## Writing text (strings) using the Bitstream
     # @param[in] txt String to be written
     # Additional method that was not planned but was proven useful
     def writeTxt(self,txt):
-        for c in txt:
-            self.writebits(ord(c),8)
+        self.writebits(int.from_bytes(bytes(ord(c) & 0xff for c in txt), 'big'), 8*len(txt))
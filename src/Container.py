@@ -0,0 +1,173 @@
+## @class Container
+# Binary file format used by the Codecs to store encoded videos
+# The file starts with a fixed header (struct) holding every parameter needed for decoding, followed by
+# the original y4m header line (so that it can be written back). Then come the chunks: each one is byte
+# aligned and starts with its type and size, followed by the coded frame (or tile) that was written to it.
+# The file ends with an index with the type and offset of every chunk and a footer pointing to the index,
+# so that any chunk can be found without reading the previous ones
+# Files written by older versions of the Codecs (free text header) do not start with the magic bytes, and
+# are still read by the Codecs themselves
+# @author Tiago Melo 89005
+# @author João Nogueira 89262
+
+import struct
+
+class Container:
+
+    magic=b'YUVC'
+    version=1
+
+    # magic, version, codec, width, height, color space, fps (numerator, denominator), total frames,
+    # Golomb parameter, flags, quantization steps, block size, search area, tiles (lines, columns) and
+    # length of the y4m header
+    headerStruct=struct.Struct('<4sBcIIHIIIIBHHHHHHHH')
+    # offset of the total frames field, which may only be known at the end
+    totalFramesOffset=struct.calcsize('<4sBcIIHII')
+    # type and size of a chunk
+    chunkStruct=struct.Struct('<cI')
+    # type and offset of a chunk, in the index
+    indexStruct=struct.Struct('<cQ')
+    # offset of the index and number of chunks
+    footerStruct=struct.Struct('<QI4s')
+
+    # codecs
+    INTRA_CODEC=b'I'
+    HYBRID_CODEC=b'H'
+    # chunk types
+    INTRA=b'I'
+    INTER=b'P'
+
+    # flags
+    ADAPTIVE=1
+    PLANAR=2
+    LOSSY=4
+    PIXEL_VECTORS=8
+    VECTOR_PREDICTION=16
+    SKIP_BLOCKS=32
+
+    def __init__(self):
+        ## Initialization function
+        # Every field of the header, to be filled in by the Codecs before writing or by read()
+        self.codec=None
+        self.width=0
+        self.height=0
+        self.colorSpace=420
+        self.fps=(0,1)
+        self.totalFrames=0
+        self.golombParam=1
+        self.adaptive=False
+        self.planar=False
+        self.quantizationStep=None
+        self.blockSize=0
+        self.searchArea=0
+        self.pixelVectors=False
+        self.vectorPrediction=False
+        self.skipBlocks=False
+        self.tiles=(1,1)
+        self.header=''
+
+        # type and offset of every chunk
+        self.kinds=[]
+        self.offsets=[]
+
+    ## Checking if a file is a Container
+    # @param[in] bs Bitstream class object (READ mode)
+    # @param[out] flag True if the file starts with the magic bytes
+    def isContainer(self,bs):
+        return bs.data[:len(self.magic)]==self.magic
+
+    ## Writing the header
+    # @param[in] bs Bitstream class object (WRITE mode), at the beginning of the file
+    def writeHeader(self,bs):
+        flags=self.ADAPTIVE*self.adaptive | self.PLANAR*self.planar | self.LOSSY*(self.quantizationStep!=None) | self.PIXEL_VECTORS*self.pixelVectors | self.VECTOR_PREDICTION*self.vectorPrediction | self.SKIP_BLOCKS*self.skipBlocks
+        q=self.quantizationStep or [0,0,0]
+        text=self.header.encode('utf-8')
+        bs.writeBytes(self.headerStruct.pack(self.magic,self.version,self.codec,self.width,self.height,self.colorSpace,
+                                             self.fps[0],self.fps[1],self.totalFrames,self.golombParam,flags,
+                                             q[0],q[1],q[2],self.blockSize,self.searchArea,self.tiles[0],self.tiles[1],len(text))+text)
+
+    ## Filling in the total number of frames, when it was not known when the header was written
+    # @param[in] bs Bitstream class object (WRITE mode, seekable file)
+    # @param[in] totalFrames Number of frames
+    def writeTotalFrames(self,bs,totalFrames):
+        self.totalFrames=totalFrames
+        bs.writeAt(self.totalFramesOffset,struct.pack('<I',totalFrames))
+
+    ## Writing a chunk
+    # @param[in] bs Bitstream class object (WRITE mode)
+    # @param[in] kind Type of the chunk (INTRA or INTER)
+    # @param[in] data Contents of the chunk
+    def writeChunk(self,bs,kind,data):
+        self.kinds.append(kind)
+        self.offsets.append(bs.tell())
+        bs.writeBytes(self.chunkStruct.pack(kind,len(data)))
+        bs.writeBytes(data)
+
+    ## Writing the index and the footer, which end the file
+    # @param[in] bs Bitstream class object (WRITE mode)
+    def writeIndex(self,bs):
+        start=bs.tell()
+        bs.writeBytes(b''.join(self.indexStruct.pack(k,o) for k,o in zip(self.kinds,self.offsets))+
+                      self.footerStruct.pack(start,len(self.offsets),self.magic))
+
+    ## Reading the header and the index
+    # @param[in] bs Bitstream class object (READ mode)
+    # Leaves bs at the first chunk
+    def read(self,bs):
+        data=bs.data
+        if len(data)<self.headerStruct.size:
+            print('Error: incomplete file (no header)')
+            exit(1)
+        fields=self.headerStruct.unpack_from(data,0)
+        magic,version,self.codec,self.width,self.height,self.colorSpace=fields[:6]
+        if magic!=self.magic or version>self.version:
+            print('Error: unsupported file format (version',version,')')
+            exit(1)
+        self.fps=fields[6:8]
+        self.totalFrames,self.golombParam,flags=fields[8:11]
+        self.adaptive=bool(flags&self.ADAPTIVE)
+        self.planar=bool(flags&self.PLANAR)
+        self.quantizationStep=list(fields[11:14]) if flags&self.LOSSY else None
+        self.pixelVectors=bool(flags&self.PIXEL_VECTORS)
+        self.vectorPrediction=bool(flags&self.VECTOR_PREDICTION)
+        self.skipBlocks=bool(flags&self.SKIP_BLOCKS)
+        self.blockSize,self.searchArea=fields[14:16]
+        self.tiles=fields[16:18]
+        if len(data)<self.headerStruct.size+fields[18]+self.footerStruct.size:
+            print('Error: incomplete file (no index)')
+            exit(1)
+        start=self.headerStruct.size
+        self.header=bytes(data[start:start+fields[18]]).decode('utf-8')
+
+        start,count,magic=self.footerStruct.unpack_from(data,len(data)-self.footerStruct.size)
+        # files whose writing was interrupted end without the index
+        if magic!=self.magic or start+count*self.indexStruct.size!=len(data)-self.footerStruct.size:
+            print('Error: incomplete file (no index)')
+            exit(1)
+        self.kinds=[]
+        self.offsets=[]
+        for i in range(0,count):
+            kind,offset=self.indexStruct.unpack_from(data,start+i*self.indexStruct.size)
+            self.kinds.append(kind)
+            self.offsets.append(offset)
+
+        bs.seek(self.headerStruct.size+fields[18])
+
+    ## Finding a chunk
+    # @param[in] i Number of the chunk
+    # @param[out] offset Offset of the contents of the chunk
+    def chunk(self,i):
+        return self.offsets[i]+self.chunkStruct.size
+
+    ## Finding the keyframe of a chunk
+    # @param[in] i Number of the chunk
+    # @param[out] key Number of the last INTRA chunk up to i, from which chunk i can be decoded
+    def keyframe(self,i):
+        while i>0 and self.kinds[i]!=self.INTRA:
+            i-=1
+        return i
+
+    ## Finding the keyframes
+    # @param[out] keys Numbers of the INTRA chunks, each one starting a group of frames that can be decoded independently
+    def keyframes(self):
+        return [i for i,kind in enumerate(self.kinds) if kind==self.INTRA]
@@ -0,0 +1,119 @@
+## @class FrameSource
+# Lazy access to the frames of a YUV (y4m) video file
+# The file is memory mapped and the position of every frame is found once, from the FRAME markers,
+# without reading the pixels; the components of a frame are then served as NumPy arrays that are
+# views of the mapped file, so only the frames being used are actually read to memory
+# The mapping is private (copy on write): components can be changed in place without changing the file
+# @author Tiago Melo 89005
+# @author João Nogueira 89262
+
+import mmap
+import numpy as np
+
+class FrameSource:
+
+    ## Initialization function
+    # @param[in] filename Path of the file to read
+    # @param[in] encoding Encoding of the header line
+    # Maps the file and reads its header (first line)
+    def __init__(self, filename, encoding='utf-8'):
+        with open(filename,'rb') as f:
+            self.data=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_COPY)
+
+        end=self.data.find(b'\n')
+        if end<0:
+            end=len(self.data)
+        self.header=self.data[:end].decode(encoding).strip()
+        self.start=end+1
+
+    ## planes function
+    # @param[in] shape Shape of the Y component
+    # @param[in] other_shape Shape of the U and V components
+    # @param[out] y,u,v FramePlanes class objects with each component of every frame
+    def planes(self, shape, other_shape):
+        yLength=shape[0]*shape[1]
+        uLength=other_shape[0]*other_shape[1]
+        frameLength=yLength+2*uLength
+
+        offsets=[]
+        pos=self.start
+        while self.data[pos:pos+5]==b'FRAME':
+            pos=self.data.find(b'\n',pos)+1
+            if pos==0 or pos+frameLength>len(self.data):
+                break
+            offsets.append(pos)
+            pos+=frameLength
+
+        return (FramePlanes(self.data,offsets,shape),
+                FramePlanes(self.data,[o+yLength for o in offsets],other_shape),
+                FramePlanes(self.data,[o+yLength+uLength for o in offsets],other_shape))
+
+
+## @class FramePlanes
+# List-like access to one component of every frame of a FrameSource
+# frames[i] returns the component of frame i as a view of the mapped file; components that are
+# replaced (frames[i]=array) are kept in memory instead
+class FramePlanes:
+
+    ## Initialization function
+    # @param[in] data Mapped file
+    # @param[in] offsets Position of the component in each frame
+    # @param[in] shape Shape of the component
+    def __init__(self, data, offsets, shape):
+        self.data=data
+        self.offsets=offsets
+        self.shape=shape
+        self.replaced={}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i,slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i<0:
+            i+=len(self)
+        if i in self.replaced:
+            return self.replaced[i]
+        return np.frombuffer(self.data,dtype=np.uint8,count=self.shape[0]*self.shape[1],offset=self.offsets[i]).reshape(self.shape)
+
+    def __setitem__(self, i, plane):
+        if i<0:
+            i+=len(self)
+        if not 0<=i<len(self):
+            raise IndexError('frame index out of range')
+        self.replaced[i]=plane
+
+    def __iter__(self):
+        for i in range(0,len(self)):
+            yield self[i]
+
+
+## @class FrameReader
+# Sequential access to the frames of a YUV (y4m) video read from a stream (pipe, socket, ...), which
+# cannot be memory mapped: each frame is only read when the previous one has been used
+class FrameReader:
+
+    ## Initialization function
+    # @param[in] f Binary file object to read from
+    # @param[in] encoding Encoding of the header line
+    # Reads the header (first line)
+    def __init__(self, f, encoding='utf-8'):
+        self.f=f
+        self.header=f.readline().decode(encoding).strip()
+
+    ## frames function
+    # @param[in] shape Shape of the Y component
+    # @param[in] other_shape Shape of the U and V components
+    # @param[out] y,u,v Generator of the components of each frame, until the end of the stream
+    def frames(self, shape, other_shape):
+        yLength=shape[0]*shape[1]
+        uLength=other_shape[0]*other_shape[1]
+        while self.f.readline().startswith(b'FRAME'):
+            data=self.f.read(yLength+2*uLength)
+            if len(data)<yLength+2*uLength:
+                return
+            frame=np.frombuffer(bytearray(data),dtype=np.uint8)
+            yield (frame[:yLength].reshape(shape),
+                   frame[yLength:yLength+uLength].reshape(other_shape),
+                   frame[yLength+uLength:].reshape(other_shape))
@@ -1,12 +1,24 @@
 ## @class Golomb 
 # Basic implementation of an encoder/decoder using Golomb Codes
+# Any M>=1 is supported, remainders use truncated binary codes when M is not a power of 2
+# Codes of the most common (small) values are kept in lookup tables, shared by every coder with
+# the same "M" and only built when first needed
 # @author Tiago Melo 89005
 # @author João Nogueira 89262
 
 import math
+import numpy as np
 
 class Golomb:
 
+    # Numbers encoded through the encoding table (0..511 covers 8-bit residuals)
+    tableSize=512
+    # Number of bits looked at, at once, by the decoding table
+    tableBits=16
+    # Tables already built, by factor
+    encodeTables={}
+    decodeTables={}
+
     def __init__(self, factor):
         ## Initialization function
         # @param[in] factor The value of "M" to be assigned to the Golomb Coder
@@ -16,9 +28,18 @@ class Golomb:
         self.sequenceFlag=False
         self.standardM=False
 
-        if math.log(factor,2).is_integer():
+        if factor&(factor-1)==0:
             self.standardM=True
 
+        # number of bits of the remainder = floor(log(factor,2))
+        # remainders below cutoff use remainderBits bits, the others (shifted by cutoff) one more
+        self.remainderBits=factor.bit_length()-1
+        self.cutoff=(1<<(self.remainderBits+1))-factor
+
+        # lookup tables, built on first use
+        self.codes=None
+        self.tables=[None,None]
+
 
     ## Encoding function
     # @param[in] number The number to be encoded
@@ -29,6 +50,10 @@ class Golomb:
     def encode(self,number):
 
         number=int(number) #in case it's not a number it also works with strings
+        if 0<=number:
+            code,length=self.encodeBits(number)
+            return format(code,'0'+str(length)+'b')
+
         (q,r)=divmod(number,self.factor)
 
         un=self.convertToUnary(q)
@@ -39,12 +64,113 @@ class Golomb:
         return code
 
 
+    ## Integer encoding function
+    # @param[in] number The (non negative) number to be encoded
+    # @param[out] code Returns the encoded number as an integer
+    # @param[out] length Returns the number of bits of the code
+    # Same code as encode() but without building strings, used to write directly to a Bitstream
+    # Small numbers are looked up in the encoding table, the rest are computed
+    def encodeBits(self,number):
+        if number<self.tableSize:
+            if self.codes is None:
+                self.codes=self.encodeTable()
+            return self.codes[number]
+        return self.computeBits(number)
+
+
+    ## Computing the integer code of a number
+    # @param[in] number The (non negative) number to be encoded
+    # @param[out] code Returns the encoded number as an integer
+    # @param[out] length Returns the number of bits of the code
+    def computeBits(self,number):
+        (q,r)=divmod(number,self.factor)
+        nb=self.remainderBits
+        if r>=self.cutoff:
+            r+=self.cutoff
+            nb+=1
+
+        code=(((1<<q)-1)<<1<<nb)|r
+
+        return code,q+1+nb
+
+
+    ## Encoding table
+    # @param[out] codes List with the (code,length) pair of every number in 0..tableSize-1
+    def encodeTable(self):
+        if self.factor not in Golomb.encodeTables:
+            Golomb.encodeTables[self.factor]=[self.computeBits(n) for n in range(0,self.tableSize)]
+        return Golomb.encodeTables[self.factor]
+
+
+    ## Decoding table
+    # @param[in] signed Flag indicating if the codes are preceded by a sign bit
+    # @param[out] table List indexed by the next tableBits bits of a Bitstream
+    # Each entry holds the (value,length) pair of the code those bits start with, or None if the
+    # code is longer than tableBits (the value then has to be decoded bit by bit)
+    def decodeTable(self,signed):
+        key=(self.factor,signed)
+        if key not in Golomb.decodeTables:
+            table=[None]*(1<<self.tableBits)
+            n=0
+            while True:
+                code,length=self.computeBits(n)
+                length+=signed
+                if length>self.tableBits:
+                    break
+                for sign in range(0,1+signed):
+                    prefix=(sign<<(length-1))|code
+                    span=1<<(self.tableBits-length)
+                    table[prefix*span:(prefix+1)*span]=[(-n if sign else n,length)]*span
+                n+=1
+            Golomb.decodeTables[key]=table
+        self.tables[signed]=Golomb.decodeTables[key]
+        return self.tables[signed]
+
+
+    ## Array encoding function
+    # @param[in] values Array (any shape) of numbers to be encoded
+    # @param[in] signed Flag indicating if each code is preceded by a sign bit (1 if negative)
+    # @param[out] bits Array with one element (0 or 1) per bit of the concatenated codes
+    # Computes quotients, remainders and code lengths of every value at once, and scatters the
+    # 1's of the unary codes, sign bits and remainder bits at their offsets in the bit array
+    def encodeArray(self,values,signed=True):
+        values=np.asarray(values,dtype=np.int64).ravel()
+
+        k=self.remainderBits
+        n=np.abs(values)
+        q,r=np.divmod(n,self.factor)
+        # truncated binary: remainders from cutoff on take one more bit
+        long=r>=self.cutoff
+        r=r+self.cutoff*long
+        nb=k+long
+
+        lengths=q+nb+(1+signed)
+        starts=np.cumsum(lengths)-lengths
+        total=int(lengths.sum())
+        bits=np.zeros(total,dtype=np.uint8)
+
+        if signed:
+            bits[starts[values<0]]=1
+        unary=starts+signed
+
+        ones=int(q.sum())
+        if ones:
+            bits[np.arange(ones)+np.repeat(unary-(np.cumsum(q)-q),q)]=1
+
+        remainder=unary+q+1
+        for i in range(0,k):
+            bits[remainder+i]=(r>>(nb-1-i))&1
+        bits[remainder[long]+k]=r[long]&1
+
+        return bits
+
+
     ## Decoding function
     # @param[in] sequence The sequence of 0's and 1's (the code)
     # @param[out] number Returns decoded number
     # Iterating sequence:
     # Quotient is the sum of 1's until a 0 appears
-    # Remainder is the direct conversion of binary code to integer
+    # Remainder is the direct conversion of binary code to integer (undoing the truncated binary shift if M!=2^x)
     # Number = factor*quotient + remainder
     def decode(self,sequence):
         self.sequenceFlag=False
@@ -62,9 +188,12 @@ class Golomb:
             else:
                 q+=1
 
-        r=int(r,2)
+        k=self.remainderBits
+        rest=int('0'+r[:k],2)
+        if rest>=self.cutoff:
+            rest=int(r[:k+1],2)-self.cutoff
 
-        number=self.factor*q+r
+        number=self.factor*q+rest
 
         return number
 
@@ -74,12 +203,7 @@ class Golomb:
     # @param[out] sequence The Unary code sequence
     # In this implementation we add X 1's where X=number, followed by a 0
     def convertToUnary(self,number):
-        sequence=''
-
-        for i in range(0,number):
-            sequence+='1'
-
-        sequence+='0'
+        sequence='1'*number+'0'
 
         return sequence
 
@@ -88,18 +212,60 @@ class Golomb:
     # @param[in] number The number to be encoded to Binary
     # @param[out] sequence The Binary code sequence
     # If our factor=2^x then it's normal binary encoding, keeping in mind the number of bits should be equal to log(factor,2)
-    # If it isn't then truncated binary encoding is not implemented
+    # If it isn't then truncated binary encoding is used: the first (cutoff) numbers use floor(log(factor,2)) bits,
+    # the remaining ones are shifted by cutoff and use one more bit
     def convertToBinary(self,number):
-        if self.standardM:
-            sequence="{0:b}".format(number) #alternative para retirar 0b
-            nb=int(math.log(self.factor,2))
-            dif=nb-len(sequence)
-
-            if dif!=0: #adding 0's so that the number of bits of the Remainder = log(factor,2)
-                for i in range(0,dif):
-                    sequence='0'+sequence
-
-            return sequence
-        else:
-            print('not implemented for m!=2^x')
-            exit(0)
\ No newline at end of file
+        nb=self.remainderBits
+        if number>=self.cutoff:
+            number+=self.cutoff
+            nb+=1
+        if nb==0:
+            return ''
+        return format(number,'0'+str(nb)+'b')
+
+
+## @class AdaptiveGolomb
+# Adaptive selection of the Golomb parameter, as in LOCO-I/JPEG-LS
+# For each context, the sum of the absolute values coded (A) and their number (N) are kept, and
+# every value is coded with M=2^k for the smallest k such that N*2^k >= A
+# Since the choice only depends on values already coded, the decoder makes the same choices and no
+# side information needs to be written
+class AdaptiveGolomb:
+
+    # Initial A for 8-bit samples and value of N at which A and N are halved (JPEG-LS defaults)
+    initialA=4
+    resetN=64
+
+    def __init__(self, contexts):
+        ## Initialization function
+        # @param[in] contexts Number of contexts (independent running statistics) to keep
+        self.A=[self.initialA]*contexts
+        self.N=[1]*contexts
+
+        # Golomb coders by k, created when first needed
+        self.coders={}
+
+    ## Coder selection function
+    # @param[in] context Context of the next value
+    # @param[out] g Golomb class object with the parameter chosen for the next value
+    def coder(self,context):
+        a=self.A[context]
+        n=self.N[context]
+        k=0
+        while (n<<k)<a:
+            k+=1
+        if k not in self.coders:
+            self.coders[k]=Golomb(1<<k)
+        return self.coders[k]
+
+    ## Update function
+    # @param[in] context Context of the value that was coded
+    # @param[in] value Value that was coded
+    # Adds the value to the running statistics of the context, halving them every resetN values
+    # so that they follow local changes
+    def update(self,context,value):
+        self.A[context]+=abs(value)
+        self.N[context]+=1
+        if self.N[context]==self.resetN:
+            self.A[context]>>=1
+            self.N[context]>>=1
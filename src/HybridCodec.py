@@ -7,18 +7,31 @@
 # @author João Nogueira 89262
 
 import numpy as np
+import io
+import copy
+import itertools
+import collections
+import multiprocessing
+from fractions import Fraction
+from FrameSource import *
 import math
 from Golomb import *
 from Bitstream import *
+from Predictor import *
+from Container import *
+from MotionEstimator import *
 
 class HybridCodec:
 
     ## Initialization function
-    # @param[in] filename Path of the file to read
+    # @param[in] filename Path of the file to read (or binary file object, such as a pipe, with a video to be encoded)
     # @param[in] encoded A flag used to indicate if the video in the given path was encoded by this same class
     # @param[in] limitFrames Optional parameter to limit the number of frames to considered
+    # @param[in] frames Optional iterable with the numbers of the frames to be decoded, e.g. range(100,200) (replaces limitFrames)
+    # @param[in] workers Optional number of processes decoding groups of frames in parallel (container files only)
+    # @param[in] lazy Optional flag for only reading the header of an encoded video, its frames being then decoded one at a time with iter_frames
     # Initializing and setting up some useful parameters and flags
-    def __init__(self, filename, encoded=False, limitFrames=None):
+    def __init__(self, filename, encoded=False, limitFrames=None, frames=None, workers=1, lazy=False):
 
         self.vid = filename
 
@@ -31,7 +44,22 @@ class HybridCodec:
 
         self.encoded=False
         self.quantizationStep=None
+        self.adaptive=False
+        self.planar=False
+        self.container=False
+        self.fps=Fraction(0)
+        self.reader=None
         self.colorSpace=None
+        self.sceneThreshold=None
+        self.pixelVectors=False
+        self.vectorPrediction=False
+        self.skipBlocks=False
+        self.skipThreshold=0
+        self.motionSearch=None
+        self.earlyStop=None
+        self.previousVectors=None
+        # work done by the motion search of every inter frame encoded (see MotionEstimator)
+        self.motionStats=collections.Counter()
 
         np.seterr(over='ignore')
 
@@ -40,138 +68,354 @@ class HybridCodec:
             self.read_video()
         else:
             self.encoded=True
-            self.read_encoded_video(limitFrames=limitFrames)
+            if lazy:
+                bs=BitStream(self.vid,'READ')
+                self.readHeader(bs)
+                bs.close()
+            else:
+                self.read_encoded_video(limitFrames=limitFrames,frames=frames,workers=workers)
     
     ## read_video function
     # Reads YUV video information from file, storing all its data in our structures, calculating different components lengths and shapes
+    # Frames are not read here: the file is memory mapped and each component is read when it is first used (see FrameSource)
     def read_video(self):
-        f=open(self.vid,"rb")
-        c=1
-
-        for line in f:
-
-            # Processing header
-            if c==1:
-                line=line.decode(self.encoding)
-                self.header=line.strip()
-                self.handleHeader()
-            
-            # Rest of the video
-            if c>=2:
+        if hasattr(self.vid,'read'):
+            # streams are read frame by frame while encoding (see frames)
+            self.reader=FrameReader(self.vid,self.encoding)
+            self.header=self.reader.header
+            self.handleHeader()
+            self.TotalFrames=None
+            return
+
+        source=FrameSource(self.vid,self.encoding)
+        self.header=source.header
+        self.handleHeader()
 
-                frameY=f.read(self.yLength)
-                frameU=f.read(self.uLength)
-                frameV=f.read(self.vLength)
+        self.frameY,self.frameU,self.frameV=source.planes(self.shape,self.other_shape)
 
-                y=np.frombuffer(frameY, dtype=np.uint8)
-                u=np.frombuffer(frameU, dtype=np.uint8)
-                v=np.frombuffer(frameV, dtype=np.uint8)
+        self.TotalFrames=len(self.frameY)
 
-                y=y.reshape(self.shape)
-                u=u.reshape(self.other_shape)
-                v=v.reshape(self.other_shape)
+    ## frames function
+    # @param[in] limitFrames Optional parameter to limit the number of frames
+    # @param[out] frames Generator of the components y,u,v of each frame, read as they are needed
+    def frames(self,limitFrames=None):
+        if self.reader!=None:
+            frames=self.reader.frames(self.shape,self.other_shape)
+        else:
+            frames=zip(self.frameY,self.frameU,self.frameV)
+        return itertools.islice(frames,limitFrames)
 
-                self.frameY+=[y]
-                self.frameU+=[u]
-                self.frameV+=[v]
+    ## read_encoded_video function
+    # @param[in] limitFrames Optional parameter to limit the number of frames to be decoded (same as frames=range(limitFrames))
+    # @param[in] frames Optional iterable with the numbers of the frames to be decoded, in the order they are wanted
+    # @param[in] workers Optional number of processes decoding groups of frames in parallel
+    # Reads video information (encoded by this class) from file, storing all the decoded frames in our structures (see iter_frames)
+    def read_encoded_video(self,limitFrames=None,frames=None,workers=1):
+        self.frameY=[]
+        self.frameU=[]
+        self.frameV=[]
+        for y,u,v in self.iter_frames(frames=frames,workers=workers,limitFrames=limitFrames):
+            self.frameY.append(y)
+            self.frameU.append(u)
+            self.frameV.append(v)
+
+    ## readHeader function
+    # @param[in] bs Bitstream class object, at the beginning of the file
+    # @param[out] container Container class object with the header and index of the file (None for files with a text header)
+    # Reads and interprets the header of an encoded video, leaving bs at the first frame
+    def readHeader(self,bs):
+        container=Container()
+        if container.isContainer(bs):
+            container.read(bs)
+            self.useContainer(container)
+            return container
 
-            c+=1
+        headerlen=bs.read_n_bits(8)
 
-        self.TotalFrames=len(self.frameY)
+        res=bs.readbits(headerlen*8)
+        self.header=self.decode_binary_string(res)
 
-        f.close()
+        #handle header
+        self.handleHeader()
+        return None
+
+    ## newContainer function
+    # @param[out] container Container class object with the parameters of this video
+    def newContainer(self):
+        container=Container()
+        container.codec=container.HYBRID_CODEC
+        container.width=self.width
+        container.height=self.height
+        container.colorSpace=int(self.colorSpace.replace(':',''))
+        container.fps=(self.fps.numerator,self.fps.denominator)
+        container.golombParam=self.golombParam
+        container.adaptive=self.adaptive
+        container.planar=self.planar
+        container.quantizationStep=self.quantizationStep
+        container.blockSize=self.block_size
+        container.searchArea=self.search_area
+        container.pixelVectors=self.pixelVectors
+        container.vectorPrediction=self.vectorPrediction
+        container.skipBlocks=self.skipBlocks
+        container.header=self.header
+        return container
+
+    ## useContainer function
+    # @param[in] container Container class object read from a file
+    # Assigns the parameters in the header of the file to class variables
+    def useContainer(self,container):
+        self.header=container.header
+        self.width=container.width
+        self.height=container.height
+        self.fps=Fraction(*container.fps)
+        self.colorSpace=container.colorSpace
+        self.golombParam=container.golombParam
+        self.TotalFrames=container.totalFrames
+        self.adaptive=container.adaptive
+        self.planar=container.planar
+        self.quantizationStep=container.quantizationStep
+        self.block_size=container.blockSize
+        self.search_area=container.searchArea
+        self.pixelVectors=container.pixelVectors
+        self.vectorPrediction=container.vectorPrediction
+        self.skipBlocks=container.skipBlocks
+        self.encoded=True
+        self.container=True
 
-    ## read_encoded_video function
-    # @param[in] limitFrames Optional parameter to limit the number of frames to be decoded
-    # Reads video information (encoded by this class) from file
+        print(self.header)
+        self.computeShape()
+        self.printHeader()
+
+    ## golombCoder function
+    # @param[out] g Golomb class object with the parameter of the video, or AdaptiveGolomb class object with initial statistics
+    def golombCoder(self):
+        if self.adaptive:
+            return AdaptiveGolomb(5)
+        return Golomb(self.golombParam)
+
+    ## iter_frames function
+    # @param[in] frames Optional iterable with the numbers of the frames to be decoded, in the order they are wanted (container files only)
+    # @param[in] workers Optional number of processes decoding groups of frames in parallel (container files only)
+    # @param[in] limitFrames Optional parameter to limit the number of frames to be decoded (same as frames=range(limitFrames))
+    # @param[out] frames Generator of the components y,u,v of each decoded frame
     # Starts by decoding and interpreting the header, followed by decoding of all the pixel blocks errors and recreating the original pixel based on the vector indicating the most similar block used for calculating the differences
-    def read_encoded_video(self,limitFrames=None):
+    # Each frame is given as soon as it is decoded, only the previous one being kept as reference, so frames can be processed one at a time in bounded memory
+    # In container files decoding of a frame starts at its keyframe (see Container.keyframe), so finding a frame costs at most
+    # one group of frames, and groups can be decoded by a pool of processes; otherwise frames are decoded in sequence
+    def iter_frames(self,frames=None,workers=1,limitFrames=None):
         bs=BitStream(self.vid,'READ')
-        headerlen=bs.read_n_bits(8)
+        container=self.readHeader(bs)
 
-        chars=[]
-        for i in range(0,headerlen*8):
-            chars.append(str(bs._readbit()))
+        if container!=None:
+            if frames==None:
+                frames=range(0,len(container.offsets) if limitFrames==None else limitFrames)
+            for y,u,v in self.decodeGroups(bs,container,self.groups(container,frames),workers):
+                yield y,u,v
+            bs.close()
+            return
 
-        res=''.join(chars)
-        self.header=self.decode_binary_string(res)
+        if frames!=None:
+            print('Error: frames can only be chosen in container files')
+            exit(1)
 
-        #handle header
-        self.handleHeader()
-        
-        g=Golomb(self.golombParam)
-        bitsResto=int(math.log(self.golombParam,2))
+        g=self.golombCoder()
 
-        if limitFrames==None:
-            l=self.TotalFrames
-        else:
+        if limitFrames!=None:
             l=limitFrames
-        #
-        self.frameY=[None]*l
-        self.frameU=[None]*l
-        self.frameV=[None]*l
-        #
+        else:
+            l=self.TotalFrames
+
+        predictor=Predictor(self.colorSpace,self.shape)
+
+        # copy holding only the reference frame and the frame being decoded
+        codec=self.frameCopy([])
         for frame in range(0,l):
             print('decoding frame',frame)
+            if frame==0:
+                codec.frameY,codec.frameU,codec.frameV=[None],[None],[None]
+            else:
+                codec.frameY=[codec.frameY[-1],None]
+                codec.frameU=[codec.frameU[-1],None]
+                codec.frameV=[codec.frameV[-1],None]
+            y,u,v=codec.readFrame(len(codec.frameY)-1,bs,g,predictor)
+            codec.frameY[-1]=y
+            codec.frameU[-1]=u
+            codec.frameV[-1]=v
+            yield y,u,v
+        #
+        bs.close()
+
+    ## groups function
+    # @param[in] container Container class object with the index of the file
+    # @param[in] frames Iterable with the numbers of the frames to be decoded, in the order they are wanted
+    # @param[out] groups List of lists of frame numbers, consecutive wanted frames with the same keyframe being kept together
+    def groups(self,container,frames):
+        groups=[]
+        key=None
+        for frame in frames:
+            if not 0<=frame<len(container.offsets):
+                print('Error: frame',frame,'is not in the video')
+                exit(1)
+            k=container.keyframe(frame)
+            if k!=key:
+                groups.append([])
+                key=k
+            groups[-1].append(frame)
+        return groups
+
+    ## decodeGroups function
+    # @param[in] bs Bitstream class object
+    # @param[in] container Container class object with the index of the file
+    # @param[in] groups List of lists of frame numbers (see groups)
+    # @param[in] workers Number of processes decoding groups in parallel
+    # @param[out] frames Generator of the components y,u,v of each wanted frame, in order
+    # Groups are only handed to the workers as they are needed, a few more than workers being decoded ahead of the
+    # one taken from frames, so memory stays bounded when frames are consumed slowly
+    def decodeGroups(self,bs,container,groups,workers):
+        if workers<=1:
+            predictor=Predictor(self.colorSpace,self.shape)
+            for group in groups:
+                for y,u,v in self.decodeGroup(bs,container,group,predictor):
+                    yield y,u,v
+            return
+
+        pool=multiprocessing.Pool(workers)
+        try:
+            pending=collections.deque()
+            for group in groups:
+                pending.append(pool.apply_async(decodeGroupWorker,((self.frameCopy([]),container,group),)))
+                while len(pending)>2*workers:
+                    for y,u,v in pending.popleft().get():
+                        yield y,u,v
+            while pending:
+                for y,u,v in pending.popleft().get():
+                    yield y,u,v
+        finally:
+            pool.terminate()
+
+    ## decodeGroup function
+    # @param[in] bs Bitstream class object
+    # @param[in] container Container class object with the index of the file
+    # @param[in] group List of frame numbers with the same keyframe
+    # @param[in] predictor Predictor class object
+    # @param[out] frames Generator of the components y,u,v of each frame of group, in order
+    # Decoding starts at the keyframe and goes up to the last wanted frame; wanted frames that come before
+    # others that are wanted first are kept until they are given
+    def decodeGroup(self,bs,container,group,predictor):
+        key=container.keyframe(group[0])
+        wanted=collections.Counter(group)
+        decoded={}
+        n=0
+
+        # copy holding only the reference frame and the frame being decoded
+        codec=self.frameCopy([])
+        for frame in range(key,max(group)+1):
+            print('decoding frame',frame)
+            if container.kinds[frame]==container.INTRA:
+                codec.frameY,codec.frameU,codec.frameV=[None],[None],[None]
+            else:
+                codec.frameY=[codec.frameY[-1],None]
+                codec.frameU=[codec.frameU[-1],None]
+                codec.frameV=[codec.frameV[-1],None]
+            # chunks are byte aligned and start with fresh adaptive Golomb statistics
+            bs.seek(container.chunk(frame))
+            y,u,v=codec.readFrame(len(codec.frameY)-1,bs,self.golombCoder(),predictor)
+            codec.frameY[-1]=y
+            codec.frameU[-1]=u
+            codec.frameV[-1]=v
+            if frame in wanted:
+                decoded[frame]=(y,u,v)
+            while n<len(group) and group[n] in decoded:
+                f=group[n]
+                yield decoded[f]
+                wanted[f]-=1
+                if wanted[f]==0:
+                    del decoded[f]
+                n+=1
+
+    ## readFrame function
+    # @param[in] frame Frame number (the previous frame is used as reference)
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # @param[out] y,u,v Decoded frame components
+    def readFrame(self,frame,bs,g,predictor):
+        # in lossy coding of subsampled chroma, each component is reconstructed several times, the last one prevailing
+        wavefront=self.quantizationStep==None or self.colorSpace=='4:4:4'
 
-            y=np.zeros(shape=self.shape,dtype=np.uint8)
-            u=np.zeros(shape=self.other_shape,dtype=np.uint8)
-            v=np.zeros(shape=self.other_shape,dtype=np.uint8)
+        y=np.zeros(shape=self.shape,dtype=np.uint8)
+        u=np.zeros(shape=self.other_shape,dtype=np.uint8)
+        v=np.zeros(shape=self.other_shape,dtype=np.uint8)
 
-            if frame==0:
-            
-                for line in range(0, self.height):
-                    for column in range(0,self.width):
-                        pixel=self.decodeWithBitstream(3,bs,g,bitsResto)
+        if frame==0 and self.planar:
+            y,u,v=self.decodePlanes(bs,g,predictor)
 
-                        a=self.getYUVPixel(frame,line,column-1, resized=False)
-                        c=self.getYUVPixel(frame,line-1,column-1, resized=False)
-                        b=self.getYUVPixel(frame,line-1,column, resized=False)
-                        x=self.predict(a,c,b)
-                        pixel=self.sum(x,pixel)
+        elif frame==0 and wavefront:
+            erro=self.decodeResiduals(bs,g)
+            y,u,v=predictor.reconstruct(erro)
 
-                        pixel=tuple(pixel)
+        elif frame==0:
+        
+            for line in range(0, self.height):
+                for column in range(0,self.width):
+                    pixel=self.decodeWithBitstream(3,bs,g)
 
-                        l,c=self.adjustCoord(line,column)
+                    a=self.getYUVPixel(frame,line,column-1, resized=False)
+                    c=self.getYUVPixel(frame,line-1,column-1, resized=False)
+                    b=self.getYUVPixel(frame,line-1,column, resized=False)
+                    x=self.predict(a,c,b)
+                    pixel=self.sum(x,pixel)
 
-                        y[line,column]=pixel[0]                        
-                        u[l,c]=pixel[1]
-                        v[l,c]=pixel[2]
-                        #
-                        self.frameY[frame]=y
-                        self.frameU[frame]=u
-                        self.frameV[frame]=v
+                    pixel=tuple(pixel)
 
+                    l,c=self.adjustCoord(line,column)
+
+                    y[line,column]=pixel[0]                        
+                    u[l,c]=pixel[1]
+                    v[l,c]=pixel[2]
+                    #
+                    self.frameY[frame]=y
+                    self.frameU[frame]=u
+                    self.frameV[frame]=v
+
+        else:
+            blocks=self.blockArray(frame-1,self.block_size,predictor)
+            bl,bc=blocks.shape[:2]
+            n=self.block_size*self.block_size
+            skip=np.zeros(shape=bl*bc,dtype=bool)
+            if self.skipBlocks:
+                skip=bs.read_bit_array(bl*bc).astype(bool)
+            count=bl*bc-int(skip.sum())
+
+            if self.quantizationStep==None and not self.adaptive:
+                coded=bs.read_golomb_array(count*(2+3*n),g).reshape(count,2+3*n)
             else:
-                blocks=self.getBlocks(frame-1,self.block_size)
-                bl,bc=blocks.shape
-                for i1 in range(0,bl):
-                    for i2 in range(0,bc):
-                        vetor=self.decodeWithBitstream(2,bs,g,bitsResto)
-                        v1,v2=vetor
-                        #print(vetor)
-                        bestBlock=blocks[v1,v2]
-                        for l in range(0,self.block_size):
-                            for c in range(0,self.block_size):
-                                pixelErro=self.decodeWithBitstream(3,bs,g,bitsResto)
-                                referencePixel=bestBlock[l,c]
-                                pixel=self.sum(pixelErro,referencePixel)
-
-                                line,column=self.block_size*i1+l,self.block_size*i2+c           
-                                li,co=self.adjustCoord(line,column)
-
-                                y[line,column]=pixel[0]                        
-                                u[li,co]=pixel[1]
-                                v[li,co]=pixel[2]
-
-
-
-                self.frameY[frame]=y
-                self.frameU[frame]=u
-                self.frameV[frame]=v
-        #
-        bs.close()
+                coded=np.array([self.decodeWithBitstream(2,bs,g,context=3)+[e for i in range(0,n) for e in self.decodeWithBitstream(3,bs,g)]
+                                for block in range(0,count)],dtype=np.int64).reshape(count,2+3*n)
+
+            # skipped blocks are at the predicted vector (no displacement without prediction), without errors
+            values=np.zeros(shape=(bl*bc,2+3*n),dtype=np.int64)
+            values[~skip]=coded
+            if not self.vectorPrediction and not self.pixelVectors:
+                values[skip,:2]=np.indices((bl,bc)).reshape(2,-1).T[skip]
+            vectors=values[:,:2].reshape(bl,bc,2)
+            if self.vectorPrediction:
+                estimator=MotionEstimator(self.block_size,self.search_area)
+                vectors=estimator.addPredictions(vectors)
+                if not self.pixelVectors:
+                    vectors=estimator.positions(vectors)
+            residuals=values[:,2:].reshape(blocks.shape)
+
+            if self.pixelVectors:
+                estimator=MotionEstimator(self.block_size,self.search_area)
+                reference=estimator.blocksAt(estimator.referenceWindows(self.pixelArray(frame-1,self.block_size,predictor)),vectors)
+            else:
+                reference=blocks[vectors[...,0],vectors[...,1]]
+            # residuals of older files may have wrapped around (8 bits), which the sum modulo 256 undoes
+            pixels=(reference.astype(np.int64)+residuals)&255
+            self.blocksToPlanes(pixels.astype(np.uint8),y,u,v)
 
+        return y,u,v
 
     ## handleHeader function
     # Interpreting the header of the file, containing width, height, frames per second and color space, assigning them to class variables
@@ -187,14 +431,19 @@ class HybridCodec:
             elif c=='H':
                 self.height=int(field[1:])
             elif c=='F':
-                self.fps=int(field[1:3])
+                fps=field[1:].split(':')
+                self.fps=Fraction(int(fps[0]),int(fps[1]) if len(fps)>1 else 1)
             elif c=='C':
                 self.colorSpace=int(field[1:])
             elif c=='G':
-                self.golombParam=int(field[-1:])
+                self.golombParam=int(field[6:])
                 self.encoded=True
             elif c=='z':
                 self.TotalFrames=int(field[1:])
+            elif c=='a':
+                self.adaptive=field[1:]=='1'
+            elif c=='p':
+                self.planar=field[1:]=='1'
             elif c=='q':
                 qlist=field[1:]
                 qsteps=qlist.split(':')
@@ -203,13 +452,36 @@ class HybridCodec:
                 self.block_size=int(field[1:])
             elif c=='s':
                 self.search_area=int(field[1:])
+            elif c=='m':
+                self.pixelVectors=field[1:]=='1'
+            elif c=='d':
+                self.vectorPrediction=field[1:]=='1'
+            elif c=='k':
+                self.skipBlocks=field[1:]=='1'
                     
         self.computeShape()
+        self.printHeader()
+
+    ## printHeader function
+    # Shows the parameters of the video
+    def printHeader(self):
         print('width=',self.width, 'height=',self.height, self.fps, self.colorSpace, self.frameLength)
         if self.encoded:
             print('g=',self.golombParam, 'totalframes=',self.TotalFrames)
         if self.quantizationStep!=None:
             print('q=',self.quantizationStep)
+        if self.adaptive:
+            print('adaptive golomb')
+        if self.planar:
+            print('planar coding')
+        if self.container:
+            print('container file')
+        if self.pixelVectors:
+            print('pixel motion vectors')
+        if self.vectorPrediction:
+            print('predicted motion vectors')
+        if self.skipBlocks:
+            print('skip blocks')
 
     ## adjustCoord function
     # @param[in] line Line where the pixel is located
@@ -392,53 +664,45 @@ class HybridCodec:
     def getFrames(self):
         return self.frameY, self.frameU,self.frameV
 
-    ## getBlock function
-    # @param[in] firstPixel Initial pixel, where the block begins
-    # @param[in] length Block length (squares)
+    ## pixelArray function
     # @param[in] frame Frame number
-    # @param[out] yuv Block containing all the pixel's components
-    # Constructs a pixel block based on the initial pixel, frame and block length
-    def getBlock(self,firstPixel,length,frame):
-        yuv=np.zeros(shape=(length,length,3), dtype=np.uint8)
-        l,c=firstPixel
-        fl,fc=l+length,c+length
-        c1,c2=0,0
-        for line in range(l,fl):
-            for col in range(c,fc):
-                p=self.getYUVPixel(frame,line,col,resized=False)
-                #print(p)
-                yuv[c1,c2]=p
-                c2+=1
-            c1+=1
-            c2=0
-        
-
-        return yuv
-
-    ## getBlocks function
+    # @param[in] block_size Block length (squares)
+    # @param[in] predictor Optional Predictor class object
+    # @param[out] pixels Array with the components of every pixel, chroma being taken at luma resolution as in getYUVPixel
+    # When the width or height are not multiples of block_size, the last column and line are repeated up to the next
+    # multiple, so that the blocks cover the whole frame (see blocksToPlanes)
+    def pixelArray(self,frame,block_size,predictor=None):
+        if predictor==None:
+            predictor=Predictor(self.colorSpace,self.shape)
+        pixels=np.stack((np.asarray(self.frameY[frame]),predictor.toLuma(np.asarray(self.frameU[frame])),predictor.toLuma(np.asarray(self.frameV[frame]))),axis=-1)
+        return np.pad(pixels,((0,-self.height%block_size),(0,-self.width%block_size),(0,0)),mode='edge')
+
+    ## blockArray function
     # @param[in] frame Frame number
     # @param[in] block_size Block length (squares)
-    # @param[out] blocks Matrix of blocks of given frame
-    # Constructs a matrix of pixel blocks of given frame
-    def getBlocks(self,frame,block_size):
-        firstPixel=[0,0]
-        p1=int(self.height/block_size)
-        p2=int(self.width/block_size)
-        blocks=np.zeros(shape=(p1,p2), dtype=object)
-        c1,c2=0,0
-        while True:
-            if firstPixel[0]==self.height:
-                break
-            yuv=self.getBlock(firstPixel,block_size,frame)
-            blocks[c1,c2]=yuv
-            firstPixel[1]=firstPixel[1]+block_size
-            c2+=1
-            if firstPixel[1]==self.width:
-                firstPixel[1]=0
-                c2=0
-                firstPixel[0]=firstPixel[0]+block_size
-                c1+=1
-        return blocks
+    # @param[in] predictor Optional Predictor class object
+    # @param[out] blocks Array (lines,columns,block_size,block_size,3) with the blocks of given frame
+    # The components are put together once per frame (see pixelArray); the blocks are then a view of that array, without copying
+    def blockArray(self,frame,block_size,predictor=None):
+        pixels=self.pixelArray(frame,block_size,predictor)
+        bl,bc=pixels.shape[0]//block_size,pixels.shape[1]//block_size
+        return pixels.reshape(bl,block_size,bc,block_size,3).swapaxes(1,2)
+
+    ## blocksToPlanes function
+    # @param[in] blocks Array (lines,columns,block_size,block_size,3) with the blocks of a frame (see blockArray)
+    # @param[in] y,u,v Frame components, in which the blocks are written
+    # Pixels beyond the frame (see pixelArray) are left out; chroma is taken from the last luma pixel of each chroma
+    # sample, as when writing pixel by pixel
+    def blocksToPlanes(self,blocks,y,u,v):
+        bl,bc,length=blocks.shape[:3]
+        pixels=blocks.swapaxes(1,2).reshape(bl*length,bc*length,3)[:self.height,:self.width]
+        y[:,:]=pixels[...,0]
+        if self.colorSpace=='4:2:2':
+            pixels=pixels[:,1::2]
+        elif self.colorSpace=='4:2:0':
+            pixels=pixels[1::2,1::2]
+        u[:pixels.shape[0],:pixels.shape[1]]=pixels[...,1]
+        v[:pixels.shape[0],:pixels.shape[1]]=pixels[...,2]
 
     ## encode_video function
     # @param[in] filename Path of file to write with the encoded video information
@@ -447,125 +711,304 @@ class HybridCodec:
     # @param[in] search_area Search area for inter frame method
     # @param[in] q Optional parameter for specifying each components quantization steps for lossy coding
     # @param[in] limitFrames Optional parameter for limiting number of frames to encode
+    # @param[in] adaptive Optional flag for choosing the Golomb parameter of each value adaptively (golombparam is then ignored)
+    # @param[in] planar Optional flag for coding intra frames plane by plane, each component with its own shape (False for the original pixel by pixel format)
+    # @param[in] frames Optional iterable (e.g. a generator) with the components y,u,v of each frame to encode, instead of the frames of this video
+    # @param[in] container Optional flag for writing a Container file, with each frame in its own chunk (False for the original format with a text header)
+    # @param[in] gop Optional number of frames of each group of pictures, the first of each group being intra coded (container files only, None for only the first frame)
+    # @param[in] workers Optional number of processes encoding groups of pictures in parallel (requires gop)
+    # @param[in] search Optional motion search method ('full', 'three_step', 'diamond' or 'hexagon', see MotionEstimator) for vectors with pixel accuracy, search_area being then in pixels (None for the most similar block of the previous frame within search_area blocks)
+    # @param[in] predict_vectors Optional flag for coding each vector as its difference to the median of the vectors of the neighbouring blocks (see MotionEstimator)
+    # @param[in] skip_blocks Optional flag for skipping blocks with no errors at the predicted vector, only a flag being written for each block
+    # @param[in] skip_threshold Optional largest absolute error of the blocks to be skipped (0 for lossless coding, otherwise skipped blocks are decoded as the block of the reference frame)
+    # @param[in] early_stop Optional SAD at or below which the motion search of a block stops (None for 0 with pixel accuracy and for no early termination otherwise)
+    # @param[in] scene_change Optional threshold of the mean absolute difference to the previous frame above which a frame is a scene change and is intra coded (container files only, see sceneChange)
     # Starts by encoding the header, passing additional parameters such as the Golomb factor
-    # Uses intra-coding method in the first frame, as described in the IntraCodec class
+    # Frames are encoded as they are taken from the video (or from frames), only the previous one being kept as reference, so any
+    # number of them can be encoded in bounded memory; when their number is not known in advance it is filled in the header at the end
+    # Uses intra-coding method in the first frame of each group (keyframe) and in scene changes, as described in the IntraCodec class
     # Uses inter-coding for all the remaining frames
     # That is by constructing a matrix of blocks for every frame, finding the most similar block of the previous frame to each one, and encoding that block of errors and the vector related to the most similar block's position
-    def encode_video(self, filename, golombparam,block_size, search_area, q=None, limitFrames=None):
-        if limitFrames==None:
-            l=self.TotalFrames
+    def encode_video(self, filename, golombparam,block_size, search_area, q=None, limitFrames=None, adaptive=False, planar=True, frames=None, container=True, gop=None, workers=1, search=None, predict_vectors=True, skip_blocks=True, skip_threshold=0, early_stop=None, scene_change=None):
+        if gop!=None and (gop<1 or not container):
+            print('Error: groups of pictures must have at least one frame and require a container file')
+            exit(1)
+        if scene_change!=None and not container:
+            print('Error: scene change detection requires a container file')
+            exit(1)
+        if search!=None and search not in MotionEstimator.methods:
+            print('Error: unknown motion search method',search)
+            exit(1)
+        if workers>1 and gop==None:
+            print('Error: parallel encoding requires groups of pictures (gop)')
+            exit(1)
+
+        if frames==None:
+            frames=self.frames(limitFrames)
+            total=self.TotalFrames if limitFrames==None else min(self.TotalFrames,limitFrames)
         else:
-            l=limitFrames
-
-        g=Golomb(golombparam)
-
-        bs=BitStream(filename,'WRITE')
-
-        header='ENCODED '+self.header+' Golomb'+str(golombparam)+' z'+str(self.TotalFrames)+' b'+str(block_size)+' s'+str(search_area)
+            frames=itertools.islice(frames,limitFrames)
+            total=None
+
+        self.golombParam=golombparam
+        self.adaptive=adaptive
+        self.planar=planar
+        self.block_size=block_size
+        self.search_area=search_area
+        self.container=container
+        self.sceneThreshold=scene_change
+        self.pixelVectors=search!=None
+        self.motionSearch=search
+        self.vectorPrediction=predict_vectors
+        self.skipBlocks=skip_blocks
+        self.skipThreshold=skip_threshold
+        self.earlyStop=early_stop
+        self.motionStats=collections.Counter()
         if q!=None:
-            header+=' q'+str(q[0])+':'+str(q[1])+':'+str(q[2])
             self.quantizationStep=q
-        headerlen=len(header)
-        bs.write_n_bits(headerlen,8)
-        bs.writeTxt(header)
-
-        for frame in range(0,l):
-            print('encoding frame',frame)
-            if frame==0:
-                for line in range(0,self.height):
-                    for column in range(0,self.width):
-                        p=self.getYUVPixel(frame,line,column, resized=False)
-
-                        a=self.getYUVPixel(frame,line,column-1, resized=False)
-                        c=self.getYUVPixel(frame,line-1,column-1, resized=False)
-                        b=self.getYUVPixel(frame,line-1,column, resized=False)
-                        x=self.predict(a,c,b)
-                        erro=self.diff(p,x)
+        g=self.golombCoder()
 
-                        self.encodeWithBitstream(erro,bs,g,pixel=p,frame=frame,line=line,column=column)
-            else:
-                blocks=self.getBlocks(frame,block_size)
-                oldBlocks=self.getBlocks(frame-1,block_size)
-
-                bl,bc=blocks.shape
-                for l in range(0,bl):
-                    for c in range(0,bc):
-                        position=l,c
-                        block=blocks[l,c]
-                        bestblock,vetor=self.findBestBlock(block,oldBlocks,search_area,position)
-                        #write vetor
-                        self.encodeWithBitstream(vetor,bs,g)
-                        #write block
-                        nl,nc=bestblock.shape[0], bestblock.shape[1]
-                        for a in range(0,nl):
-                            for b in range(0,nc):
-                                self.encodeWithBitstream(bestblock[a,b],bs,g)
-
-            
-        bs.close()
+        bs=BitStream(filename,'WRITE')
 
-    ## blockDif function
-    # @param[in] block Given block
-    # @param[in] oldBlocks Blocks from previous frame
-    # @param[in] search_area Search area for inter frame
-    # @param[in] position Given block's position in the blocks matrix
-    # @param[out] lastDif Most similar block
-    # @param[out] vetor Vector with the coordinates corresponding to the most similar block's position
-    # Calculates the 'best', most similar block (of the previous frame) to the given block
-    def findBestBlock(self,block,oldBlocks,search_area,position):
-        vetor=None
-        flag=True
-        lastDif=None
-        ol,oc=position
-        bl,bc=oldBlocks.shape
-        #print(bl,bc)
-        for l in range(0,bl):
-            for c in range(0,bc):
-                if abs(ol-l)<=search_area and abs(oc-c)<=search_area:
-                    candidateBlock=oldBlocks[l,c]
-                    dif=self.blockDif(block,candidateBlock)
-                    if flag or self.lessError(dif,lastDif):
-                        flag=False
-                        lastDif=dif
-                        vetor=[l,c]
-        return lastDif,vetor
-
-
-    ## blockDif function
-    # @param[in] block First block
-    # @param[in] candidateBlock Second block
-    # @param[out] dif Result error block
-    # Calculates differences between two blocks of pixels
-    def blockDif(self,block,candidateBlock):
-        length=block.shape[0]
-        dif=np.zeros(shape=(length,length,3), dtype=np.int8)
-        for l in range(0,length):
-            for c in range(0,length):
-                dif[l,c]=self.diff(block[l,c],candidateBlock[l,c])
-        return dif
-
-    ## lessError function
-    # @param[in] dif First block
-    # @param[in] lastDif Second block
-    # @param[out] bool Returns flag indicating if the First block is better than the second one
-    # Calculates which error block has the least differences, based on the sum of the absolute value of all errors
-    def lessError(self,dif,lastDif):
-        s1=0
-        s2=0
-        length=dif.shape[0]
-        for l in range(0,length):
-            for c in range(0,length):
-                p1=dif[l,c]
-                s1+=abs(int(p1[0]))+abs(int(p1[1]))+abs(int(p1[2]))
-                p2=lastDif[l,c]
-                s2+=abs(int(p2[0]))+abs(int(p2[1]))+abs(int(p2[2]))
-
-        #if s1==0 or s2==0:
-
-        if s1<s2:
-            return True
+        if container:
+            c=self.newContainer()
+            c.totalFrames=total or 0
+            c.writeHeader(bs)
+        else:
+            # unknown number of frames: fixed width field, overwritten at the end
+            header='ENCODED '+self.header+' Golomb'+str(golombparam)+' z'+(str(total) if total!=None else '0'*10)+' b'+str(block_size)+' s'+str(search_area)
+            if adaptive:
+                header+=' a1'
+            if planar:
+                header+=' p1'
+            if q!=None:
+                header+=' q'+str(q[0])+':'+str(q[1])+':'+str(q[2])
+            if search!=None:
+                header+=' m1'
+            if predict_vectors:
+                header+=' d1'
+            if skip_blocks:
+                header+=' k1'
+            headerlen=len(header)
+            bs.write_n_bits(headerlen,8)
+            bs.writeTxt(header)
+
+        predictor=Predictor(self.colorSpace,self.shape)
+
+        count=0
+        if workers>1:
+            for chunks in self.encodeGroups(frames,gop,workers):
+                for kind,data in chunks:
+                    c.writeChunk(bs,kind,data)
+                count+=len(chunks)
         else:
+            # copy holding only the reference frame and the frame being encoded
+            codec=self.frameCopy([])
+            for frame,planes in enumerate(frames):
+                print('encoding frame',frame)
+                key=frame%gop==0 if gop!=None else frame==0
+                if not key and self.sceneChange(codec.frameY[-1],planes[0]):
+                    print('scene change at frame',frame)
+                    key=True
+                if key:
+                    codec.frameY,codec.frameU,codec.frameV=[planes[0]],[planes[1]],[planes[2]]
+                else:
+                    codec.frameY=[codec.frameY[-1],planes[0]]
+                    codec.frameU=[codec.frameU[-1],planes[1]]
+                    codec.frameV=[codec.frameV[-1],planes[2]]
+                if container:
+                    c.writeChunk(bs,c.INTRA if key else c.INTER,codec.encodeFrame(len(codec.frameY)-1,predictor))
+                else:
+                    codec.writeFrame(len(codec.frameY)-1,bs,g,predictor)
+                count+=1
+
+        if container:
+            c.writeIndex(bs)
+            # the number of frames actually written, whatever the header said
+            c.writeTotalFrames(bs,count)
+        elif total==None and count:
+            bs.writeAt(1+header.index(' z')+2,('%010d'%count).encode())
+        bs.close()
+        if self.motionStats:
+            print('motion search of all frames:',dict(self.motionStats))
+
+    ## frameCopy function
+    # @param[in] planes List with the components y,u,v of the frames to be held by the copy
+    # @param[out] codec Copy of this HybridCodec holding only the given frames, which can be sent to other processes
+    def frameCopy(self,planes):
+        codec=copy.copy(self)
+        # streams cannot be shared with other processes, and their frames are given in planes
+        codec.reader=None
+        if hasattr(codec.vid,'read'):
+            codec.vid=None
+        codec.frameY=[p[0] for p in planes]
+        codec.frameU=[p[1] for p in planes]
+        codec.frameV=[p[2] for p in planes]
+        return codec
+
+    ## encodeGroups function
+    # @param[in] frames Iterable with the components y,u,v of each frame
+    # @param[in] gop Number of frames of each group of pictures
+    # @param[in] workers Number of processes encoding groups in parallel
+    # @param[out] chunks Generator of the list of the chunks of each group of pictures, in order
+    # Groups are independent (each one starts with an intra frame), so each one is encoded by its own process;
+    # only a few groups are read ahead of the ones being written, so memory stays bounded
+    def encodeGroups(self,frames,gop,workers):
+        pool=multiprocessing.Pool(workers)
+        try:
+            pending=collections.deque()
+            frames=iter(frames)
+            group=list(itertools.islice(frames,gop))
+            while group:
+                pending.append(pool.apply_async(encodeGroupWorker,(self.frameCopy(group),)))
+                while len(pending)>2*workers:
+                    yield pending.popleft().get()
+                group=list(itertools.islice(frames,gop))
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+    ## encodeGroup function
+    # @param[out] chunks List of the type (Container.INTRA or Container.INTER) and bytes of each frame held by this codec (see frameCopy)
+    # The first frame is intra coded, as well as scene changes
+    def encodeGroup(self):
+        predictor=Predictor(self.colorSpace,self.shape)
+        chunks=[]
+        for frame in range(0,len(self.frameY)):
+            print('encoding frame',frame,'of group')
+            if frame>0 and self.sceneChange(self.frameY[frame-1],self.frameY[frame]):
+                print('scene change at frame',frame,'of group')
+                codec=self.frameCopy([[self.frameY[frame],self.frameU[frame],self.frameV[frame]]])
+                chunks.append((Container.INTRA,codec.encodeFrame(0,predictor)))
+                self.frameY[frame],self.frameU[frame],self.frameV[frame]=codec.frameY[0],codec.frameU[0],codec.frameV[0]
+                # the motion of the frames before the cut says nothing about the next one
+                self.previousVectors=None
+            else:
+                chunks.append((Container.INTRA if frame==0 else Container.INTER,self.encodeFrame(frame,predictor)))
+        return chunks
+
+    ## sceneChange function
+    # @param[in] ref Y component of the reference (previous) frame
+    # @param[in] y Y component of the frame
+    # @param[out] flag True if the frame is too different from the reference to be predicted from it
+    # Compares the frames on a subsampled grid (one pixel in every 4x4), so it is cheap compared to the motion search;
+    # after a scene change the residuals of inter coding are as large as the pixels themselves, so intra coding is better
+    def sceneChange(self,ref,y):
+        if self.sceneThreshold==None:
             return False
+        ref=np.asarray(ref)[::4,::4].astype(np.int16)
+        y=np.asarray(y)[::4,::4]
+        return np.abs(ref-y).mean()>self.sceneThreshold
+
+    ## encodeFrame function
+    # @param[in] frame Frame number (the previous frame is used as reference)
+    # @param[in] predictor Predictor class object
+    # @param[out] data Bytes of the frame, coded with fresh adaptive Golomb statistics
+    def encodeFrame(self,frame,predictor):
+        out=io.BytesIO()
+        bs=BitStream(out,'WRITE')
+        self.writeFrame(frame,bs,self.golombCoder(),predictor)
+        bs.flush()
+        return out.getvalue()
+
+    ## writeFrame function
+    # @param[in] frame Frame number (the previous frame is used as reference)
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # The first frame is intra coded, the others are coded block by block, as the errors to the most similar block of the previous frame
+    def writeFrame(self,frame,bs,g,predictor):
+        if frame==0:
+            self.previousVectors=None
+        if frame==0 and self.planar:
+            # in lossy coding the next frame is predicted from the frame as the decoder reconstructs it
+            y,u,v=self.encodePlanes([self.frameY[frame],self.frameU[frame],self.frameV[frame]],bs,g,predictor)
+            self.frameY[frame]=y
+            self.frameU[frame]=u
+            self.frameV[frame]=v
+        elif frame==0 and (self.quantizationStep==None or self.quantizationStep==[0,0,0]):
+            # every prediction only depends on original pixels, so the whole frame is predicted at once
+            erro=predictor.residuals(self.frameY[frame],self.frameU[frame],self.frameV[frame])
+            self.encodeResiduals(erro,bs,g)
+        elif frame==0:
+            for line in range(0,self.height):
+                for column in range(0,self.width):
+                    p=self.getYUVPixel(frame,line,column, resized=False)
+
+                    a=self.getYUVPixel(frame,line,column-1, resized=False)
+                    c=self.getYUVPixel(frame,line-1,column-1, resized=False)
+                    b=self.getYUVPixel(frame,line-1,column, resized=False)
+                    x=self.predict(a,c,b)
+                    erro=self.diff(p,x)
+
+                    self.encodeWithBitstream(erro,bs,g,pixel=p,frame=frame,line=line,column=column)
+        else:
+            if self.pixelVectors:
+                # a block with no errors cannot be improved on, so with pixel accuracy the search always stops there
+                stop=self.earlyStop if self.earlyStop!=None else 0
+                estimator=MotionEstimator(self.block_size,self.search_area,self.motionSearch,stop)
+                vectors,residuals=estimator.searchPixels(self.pixelArray(frame,self.block_size,predictor),self.pixelArray(frame-1,self.block_size,predictor),self.previousVectors)
+                self.previousVectors=vectors
+            else:
+                estimator=MotionEstimator(self.block_size,self.search_area,stop=self.earlyStop)
+                vectors,residuals=estimator.search(self.blockArray(frame,self.block_size,predictor),self.blockArray(frame-1,self.block_size,predictor),self.previousVectors)
+                self.previousVectors=estimator.displacements(vectors)
+            print('motion search:',dict(estimator.stats))
+            self.motionStats.update(estimator.stats)
+
+            bl,bc=vectors.shape[:2]
+            displacements=vectors if self.pixelVectors else estimator.displacements(vectors)
+            if self.vectorPrediction:
+                vectors=estimator.vectorDifferences(displacements)
+            vectors=vectors.reshape(bl*bc,2)
+            residuals=residuals.reshape(bl*bc,-1)
+
+            if self.skipBlocks:
+                # blocks at the predicted vector (no displacement without prediction) with no errors, or errors
+                # not above the threshold, are skipped: only their flag is written
+                predicted=(vectors if self.vectorPrediction else displacements.reshape(bl*bc,2))==0
+                skip=predicted.all(axis=1) & (np.abs(residuals).max(axis=1)<=self.skipThreshold)
+                bs.write_bit_array(skip)
+                if self.skipThreshold>0:
+                    self.skipReconstruction(frame,residuals,skip,predictor)
+                vectors=vectors[~skip]
+                residuals=residuals[~skip]
+
+            if self.quantizationStep==None and not self.adaptive:
+                # vector and block of errors of every block, written at once
+                bs.write_golomb_array(np.concatenate((vectors,residuals),axis=1),g)
+                return
+
+            for i in range(0,len(vectors)):
+                #write vetor
+                self.encodeWithBitstream(vectors[i].tolist(),bs,g,context=3)
+                #write block
+                for pixel in residuals[i].reshape(-1,3):
+                    self.encodeWithBitstream(pixel,bs,g)
+
+    ## skipReconstruction function
+    # @param[in] frame Frame number
+    # @param[in] residuals Array (blocks,block_size*block_size*3) with the errors of each block
+    # @param[in] skip Array of flags of the skipped blocks
+    # @param[in] predictor Predictor class object
+    # Skipped blocks with errors are decoded as the block of the reference frame, so the frame is replaced by
+    # the decoded one, to be the reference of the next frame as in the decoder
+    def skipReconstruction(self,frame,residuals,skip,predictor):
+        lossy=skip & np.any(residuals!=0,axis=1)
+        if not lossy.any():
+            return
+        blocks=self.blockArray(frame,self.block_size,predictor).astype(np.int16)
+        shape=blocks.shape
+        blocks=blocks.reshape(len(skip),-1)
+        blocks[lossy]-=residuals[lossy]
+        y=np.array(self.frameY[frame])
+        u=np.array(self.frameU[frame])
+        v=np.array(self.frameV[frame])
+        self.blocksToPlanes(blocks.reshape(shape).astype(np.uint8),y,u,v)
+        self.frameY[frame]=y
+        self.frameU[frame]=u
+        self.frameV[frame]=v
 
     ## encodeWithBitStream function
     # @param[in] value Value to be encoded
@@ -575,56 +1018,131 @@ class HybridCodec:
     # @param[in] frame Frame where the pixel being encoded is located
     # @param[in] line Line where the pixel being encoded is located
     # @param[in] column Column where the pixel being encoded is located
+    # @param[in] context First context used by the adaptive Golomb coder (one per value, 0-2 for pixel components)
     # Switches the value to be encoded to positive, writing a 1 or 0 according to the original value
     # If using lossy coding functionality, divides color component by quantization step and updates pixel value
     # Proceeds to write the encoded value by Golomb with the Bitstream
-    def encodeWithBitstream(self, value,bs,g, pixel=None, frame=None, line=None, column=None):
+    def encodeWithBitstream(self, value,bs,g, pixel=None, frame=None, line=None, column=None, context=0):
         for i in range(0,len(value)):
-            if value[i]<0:
-                n=value[i]*-1
-                bs.writebits(1,1)
-            else:
-                bs.writebits(0,1)
-                n=value[i]
-            
+            coder=g
+            if self.adaptive:
+                coder=g.coder(context+i)
+
             if self.quantizationStep!=None and self.quantizationStep[i]!=0:
+                n=abs(int(value[i]))
+                bs.writebits(1 if value[i]<0 else 0,1)
+
                 newValue=pixel[i]+(n)
                 n=math.floor(n/self.quantizationStep[i])
                 
                 #TODO
                 if line!=0 and column!=0:
                     self.updateYUVPixel(i,frame,line,column,newValue)
-            n=g.encode(n)
-            bs.writebits(int(n,2),len(n))
+                bs.write_golomb(n,coder,signed=False)
+            else:
+                n=int(value[i])
+                bs.write_golomb(n,coder)
+
+            if self.adaptive:
+                g.update(context+i,n)
+
+    ## encodeResiduals function
+    # @param[in] erro Array with the errors of every pixel component of a frame (lossless coding)
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # Writes the same values as calling encodeWithBitstream pixel by pixel, packing the whole array at once
+    # unless the Golomb parameter is adaptive
+    def encodeResiduals(self,erro,bs,g):
+        if self.adaptive:
+            for pixel in erro.reshape(-1,3).tolist():
+                self.encodeWithBitstream(pixel,bs,g)
+        else:
+            bs.write_golomb_array(erro,g)
+
+    ## encodePlanes function
+    # @param[in] planes List with the Y, U and V components of a frame
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # @param[out] planes Components as the decoder will reconstruct them
+    # Planar coding: each component is predicted from its own neighbours, with its own shape, and all its errors
+    # are written before the next component's
+    # In lossy coding the errors are quantized and pixels are predicted from reconstructed pixels
+    def encodePlanes(self,planes,bs,g,predictor):
+        planes=list(planes)
+        for i in range(0,3):
+            if self.quantizationStep!=None and self.quantizationStep[i]!=0:
+                erro,planes[i]=predictor.quantizePlane(planes[i],self.quantizationStep[i])
+            else:
+                erro=predictor.planeResiduals(planes[i])
+
+            if self.adaptive:
+                for value in erro.ravel().tolist():
+                    bs.write_golomb(value,g.coder(i))
+                    g.update(i,value)
+            else:
+                bs.write_golomb_array(erro,g)
+        return planes
 
     ## decodeWithBitStream function
     # @param[in] len Number of values to read
     # @param[in] bs Bitstream class object
     # @param[in] g Golomb class object
-    # @param[in] bitsResto Number of bits of the remainder = log(factor,2)
+    # @param[in] context First context used by the adaptive Golomb coder
     # @param[out] pixel Decoded value
-    # Starts by reading one bit 0 or 1, determing if number was negative
-    # Reads the bits from the Bitstream and decodes them with Golomb
+    # Reads each value (sign bit and Golomb code) directly from the Bitstream
     # Multiplies by quantization step if using lossy coding
-    def decodeWithBitstream(self, len,bs,g,bitsResto):
+    def decodeWithBitstream(self, len,bs,g,context=0):
         pixel=[]
         for i in range(0,len):
-            ay=bs.read_n_bits(1)
-            seq=''
-            while True:
-                r=str(bs.read_n_bits(1))
-                seq+=r
-                if r=='0':
-                    break
-            seq+=str(bs.readbits(bitsResto))
-            comp=g.decode(seq)
-            if ay==1:
-                comp=comp*-1
+            if self.adaptive:
+                comp=bs.read_golomb(g.coder(context+i))
+                g.update(context+i,comp)
+            else:
+                comp=bs.read_golomb(g)
             if self.quantizationStep!=None and self.quantizationStep[i]!=0:
                 comp=comp*self.quantizationStep[i]
             pixel.append(comp)
         return pixel
 
+    ## decodeResiduals function
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[out] erro Array (height,width,3) with the errors of every pixel component of a frame
+    # Reads the same values as calling decodeWithBitstream pixel by pixel, all at once unless the Golomb parameter is adaptive
+    def decodeResiduals(self,bs,g):
+        if self.adaptive:
+            erro=[self.decodeWithBitstream(3,bs,g) for i in range(0,self.height*self.width)]
+            return np.array(erro,dtype=np.int64).reshape(self.height,self.width,3)
+
+        erro=bs.read_golomb_array(self.height*self.width*3,g).reshape(self.height,self.width,3)
+        if self.quantizationStep!=None:
+            erro*=[step if step!=0 else 1 for step in self.quantizationStep]
+        return erro
+
+    ## decodePlanes function
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # @param[out] planes Y, U and V components of a frame written with planar coding
+    def decodePlanes(self,bs,g,predictor):
+        planes=[]
+        for i,shape in enumerate([self.shape,self.other_shape,self.other_shape]):
+            count=shape[0]*shape[1]
+            if self.adaptive:
+                erro=np.zeros(shape=count,dtype=np.int64)
+                for j in range(0,count):
+                    erro[j]=bs.read_golomb(g.coder(i))
+                    g.update(i,int(erro[j]))
+            else:
+                erro=bs.read_golomb_array(count,g)
+
+            step=0
+            if self.quantizationStep!=None:
+                step=self.quantizationStep[i]
+            planes.append(predictor.reconstructPlane(erro.reshape(shape),step))
+        return planes
+
     ## verifyData function
     # @param[in] video Class containing video for comparison
     # @param[in] numberoframes Limits number of frames to check
@@ -643,3 +1161,21 @@ class HybridCodec:
                 print('V-',i,'correct')
 
 
+## encodeGroupWorker function
+# @param[in] codec HybridCodec holding the frames of a group of pictures (see frameCopy)
+# @param[out] chunks List of the bytes of each frame of the group
+# Run by each process of the pool in parallel encoding
+def encodeGroupWorker(codec):
+    return codec.encodeGroup()
+
+
+## decodeGroupWorker function
+# @param[in] job HybridCodec without frames (see frameCopy), Container class object with the index of the file and list of frame numbers with the same keyframe
+# @param[out] frames List of the components y,u,v of each frame of the group
+# Run by each process of the pool in parallel decoding, each one reading the file on its own
+def decodeGroupWorker(job):
+    codec,container,group=job
+    bs=BitStream(codec.vid,'READ')
+    frames=list(codec.decodeGroup(bs,container,group,Predictor(codec.colorSpace,codec.shape)))
+    bs.close()
+    return frames
@@ -5,18 +5,31 @@
 # @author João Nogueira 89262
 
 import numpy as np
+from FrameSource import *
 import math
+import io
+import copy
+import itertools
+from fractions import Fraction
+import collections
+import multiprocessing
 from Golomb import *
 from Bitstream import *
+from Predictor import *
+from Container import *
 
 class IntraCodec:
 
     ## Initialization function
-    # @param[in] filename Path of the file to read
+    # @param[in] filename Path of the file to read (or binary file object, such as a pipe, with a video to be encoded)
     # @param[in] encoded A flag used to indicate if the video in the given path was encoded by this same class
     # @param[in] limitFrames Optional parameter to limit the number of frames to considered
+    # @param[in] frames Optional iterable with the numbers of the frames to be decoded, e.g. range(100,200) (replaces limitFrames)
+    # @param[in] workers Optional number of processes decoding frames in parallel (container files only)
+    # @param[in] region Optional region (line0,line1,column0,column1) of the frames to be decoded, only the tiles overlapping it are read
+    # @param[in] lazy Optional flag for only reading the header of an encoded video, its frames being then decoded one at a time with iter_frames
     # Initializing and setting up some useful parameters and flags
-    def __init__(self, filename, encoded=False, limitFrames=None):
+    def __init__(self, filename, encoded=False, limitFrames=None, frames=None, workers=1, region=None, lazy=False):
 
         self.vid = filename
 
@@ -29,6 +42,12 @@ class IntraCodec:
 
         self.encoded=False
         self.quantizationStep=None
+        self.adaptive=False
+        self.planar=False
+        self.container=False
+        self.fps=Fraction(0)
+        self.tiles=(1,1)
+        self.reader=None
         self.colorSpace=None
 
         np.seterr(over='ignore')
@@ -38,113 +57,298 @@ class IntraCodec:
             self.read_video()
         else:
             self.encoded=True
-            self.read_encoded_video(limitFrames=limitFrames)
+            if lazy:
+                bs=BitStream(self.vid,'READ')
+                self.readHeader(bs)
+                bs.close()
+            else:
+                self.read_encoded_video(limitFrames=limitFrames,frames=frames,workers=workers,region=region)
 
     ## read_video function
     # Reads YUV video information from file, storing all its data in our structures, calculating different components lengths and shapes
+    # Frames are not read here: the file is memory mapped and each component is read when it is first used (see FrameSource)
     def read_video(self):
-        f=open(self.vid,"rb")
-        c=1
-
-        for line in f:
-
-            # Processing header
-            if c==1:
-                line=line.decode(self.encoding)
-                self.header=line.strip()
-                self.handleHeader()
-            
-            # Rest of the video
-            if c>=2:
-
-                frameY=f.read(self.yLength)
-                frameU=f.read(self.uLength)
-                frameV=f.read(self.vLength)
-
-                y=np.frombuffer(frameY, dtype=np.uint8)
-                u=np.frombuffer(frameU, dtype=np.uint8)
-                v=np.frombuffer(frameV, dtype=np.uint8)
-
-                y=y.reshape(self.shape)
-                u=u.reshape(self.other_shape)
-                v=v.reshape(self.other_shape)
-
-                self.frameY+=[y]
-                self.frameU+=[u]
-                self.frameV+=[v]
+        if hasattr(self.vid,'read'):
+            # streams are read frame by frame while encoding (see frames)
+            self.reader=FrameReader(self.vid,self.encoding)
+            self.header=self.reader.header
+            self.handleHeader()
+            self.TotalFrames=None
+            return
+
+        source=FrameSource(self.vid,self.encoding)
+        self.header=source.header
+        self.handleHeader()
 
-            c+=1
+        self.frameY,self.frameU,self.frameV=source.planes(self.shape,self.other_shape)
 
         self.TotalFrames=len(self.frameY)
 
-        f.close()
+    ## frames function
+    # @param[in] limitFrames Optional parameter to limit the number of frames
+    # @param[out] frames Generator of the components y,u,v of each frame, read as they are needed
+    def frames(self,limitFrames=None):
+        if self.reader!=None:
+            frames=self.reader.frames(self.shape,self.other_shape)
+        else:
+            frames=zip(self.frameY,self.frameU,self.frameV)
+        return itertools.islice(frames,limitFrames)
 
     ## read_encoded_video function
-    # @param[in] limitFrames Optional parameter to limit the number of frames to be decoded
-    # Reads video information (encoded by this class) from file
-    # Starts by decoding and interpreting the header, followed by decoding of all the pixel errors and recreating the original pixel based on the predictor that was used
-    def read_encoded_video(self,limitFrames=None):
-        bs=BitStream(self.vid,'READ')
-        headerlen=bs.read_n_bits(8)
+    # @param[in] limitFrames Optional parameter to limit the number of frames to be decoded (same as frames=range(limitFrames))
+    # @param[in] frames Optional iterable with the numbers of the frames to be decoded, in the order they are wanted
+    # @param[in] workers Optional number of processes decoding frames (or tiles) in parallel
+    # @param[in] region Optional region (line0,line1,column0,column1) of the frames to be decoded, the frames are cropped to it
+    # Reads video information (encoded by this class) from file, storing all the decoded frames in our structures (see iter_frames)
+    def read_encoded_video(self,limitFrames=None,frames=None,workers=1,region=None):
+        self.frameY=[]
+        self.frameU=[]
+        self.frameV=[]
+        for y,u,v in self.iter_frames(frames=frames,workers=workers,region=region,limitFrames=limitFrames):
+            self.frameY.append(y)
+            self.frameU.append(u)
+            self.frameV.append(v)
+
+    ## readHeader function
+    # @param[in] bs Bitstream class object, at the beginning of the file
+    # @param[out] container Container class object with the header and index of the file (None for files with a text header)
+    # Reads and interprets the header of an encoded video, leaving bs at the first frame
+    def readHeader(self,bs):
+        container=Container()
+        if container.isContainer(bs):
+            container.read(bs)
+            self.useContainer(container)
+            return container
 
-        chars=[]
-        for i in range(0,headerlen*8):
-            chars.append(str(bs._readbit()))
+        headerlen=bs.read_n_bits(8)
 
-        res=''.join(chars)
+        res=bs.readbits(headerlen*8)
         self.header=self.decode_binary_string(res)
 
         #handle header
         self.handleHeader()
-        
-        g=Golomb(self.golombParam)
-        bitsResto=int(math.log(self.golombParam,2))
+        return None
+
+    ## newContainer function
+    # @param[out] container Container class object with the parameters of this video
+    def newContainer(self):
+        container=Container()
+        container.codec=container.INTRA_CODEC
+        container.width=self.width
+        container.height=self.height
+        container.colorSpace=int(self.colorSpace.replace(':',''))
+        container.fps=(self.fps.numerator,self.fps.denominator)
+        container.golombParam=self.golombParam
+        container.adaptive=self.adaptive
+        container.planar=self.planar
+        container.quantizationStep=self.quantizationStep
+        container.tiles=self.tiles
+        container.header=self.header
+        return container
+
+    ## useContainer function
+    # @param[in] container Container class object read from a file
+    # Assigns the parameters in the header of the file to class variables
+    def useContainer(self,container):
+        self.header=container.header
+        self.width=container.width
+        self.height=container.height
+        self.fps=Fraction(*container.fps)
+        self.colorSpace=container.colorSpace
+        self.golombParam=container.golombParam
+        self.TotalFrames=container.totalFrames
+        self.adaptive=container.adaptive
+        self.planar=container.planar
+        self.quantizationStep=container.quantizationStep
+        self.tiles=tuple(container.tiles)
+        self.encoded=True
+        self.container=True
 
-        if limitFrames==None:
+        print(self.header)
+        self.computeShape()
+        self.printHeader()
+
+    ## iter_frames function
+    # @param[in] frames Optional iterable with the numbers of the frames to be decoded, in the order they are wanted
+    # @param[in] workers Optional number of processes decoding frames (or tiles) in parallel
+    # @param[in] region Optional region (line0,line1,column0,column1) of the frames to be decoded, the frames are cropped to it
+    # @param[in] limitFrames Optional parameter to limit the number of frames to be decoded (same as frames=range(limitFrames))
+    # @param[out] frames Generator of the components y,u,v of each decoded frame
+    # Starts by decoding and interpreting the header, followed by decoding of all the pixel errors and recreating the original pixel based on the predictor that was used
+    # Each frame is given as soon as it is decoded and is not kept, so frames can be processed one at a time in bounded memory
+    # In container files each frame is found through the index, so frames before the wanted ones are not read
+    # and frames can be decoded by a pool of processes; otherwise frames are decoded in sequence
+    # In tiled files only the tiles overlapping the region are decoded
+    def iter_frames(self,frames=None,workers=1,region=None,limitFrames=None):
+        bs=BitStream(self.vid,'READ')
+        container=self.readHeader(bs)
+
+        if frames==None and limitFrames!=None:
+            frames=range(0,limitFrames)
+
+        if container!=None:
+            offsets=[container.chunk(i) for i in range(0,len(container.offsets))]
+            bounds=self.tileBounds()
+            tiles=[t for t in range(0,len(bounds)) if region==None or self.overlaps(bounds[t],region)]
+            if frames==None:
+                frames=range(0,len(offsets)//len(bounds))
+            frames=list(frames)
+            for frame in frames:
+                if not 0<=frame<len(offsets)//len(bounds):
+                    print('Error: frame',frame,'is not in the video')
+                    exit(1)
+            planes=self.decodeFrames(bs,[(bounds[t],offsets[f*len(bounds)+t]) for f in frames for t in tiles],workers)
+            for i in range(0,len(frames)):
+                if len(bounds)==1:
+                    y,u,v=next(planes)
+                else:
+                    y=np.zeros(shape=self.shape,dtype=np.uint8)
+                    u=np.zeros(shape=self.other_shape,dtype=np.uint8)
+                    v=np.zeros(shape=self.other_shape,dtype=np.uint8)
+                    for t in tiles:
+                        l0,l1,c0,c1=bounds[t]
+                        y[l0:l1,c0:c1],tu,tv=next(planes)
+                        l0,l1,c0,c1=self.chromaBounds(bounds[t])
+                        u[l0:l1,c0:c1]=tu
+                        v[l0:l1,c0:c1]=tv
+                if region!=None:
+                    y,u,v=self.crop(y,u,v,region)
+                yield y,u,v
+            bs.close()
+            return
+
+        if workers>1:
+            print('Error: parallel decoding requires a container file')
+            exit(1)
+
+        g=self.golombCoder()
+
+        if frames==None:
             l=self.TotalFrames
         else:
-            l=limitFrames
-        #
-        self.frameY=[None]*l
-        self.frameU=[None]*l
-        self.frameV=[None]*l
-        #
+            # without an index, frames can only be reached by decoding all the previous ones;
+            # the wanted frames decoded before their turn are kept until then
+            frames=list(frames)
+            for frame in frames:
+                if not 0<=frame<self.TotalFrames:
+                    print('Error: frame',frame,'is not in the video')
+                    exit(1)
+            l=max(frames)+1
+            remaining=collections.Counter(frames)
+            decoded={}
+            next_frame=0
+
+        predictor=Predictor(self.colorSpace,self.shape)
+        # copy holding only the frame being decoded
+        codec=self.frameCopy(None)
+
         for frame in range(0,l):
             print('decoding frame',frame)
 
-            y=np.zeros(shape=self.shape,dtype=np.uint8)
-            u=np.zeros(shape=self.other_shape,dtype=np.uint8)
-            v=np.zeros(shape=self.other_shape,dtype=np.uint8)
-            
-            for line in range(0, self.height):
-                for column in range(0,self.width):
-                    pixel=self.decodeWithBitstream(3,bs,g,bitsResto)
-
-                    a=self.getYUVPixel(frame,line,column-1, resized=False)
-                    c=self.getYUVPixel(frame,line-1,column-1, resized=False)
-                    b=self.getYUVPixel(frame,line-1,column, resized=False)
-                    x=self.predict(a,c,b)
-                    pixel=self.sum(x,pixel)
-
-                    pixel=tuple(pixel)
-
-                    l,c=self.adjustCoord(line,column)
-
-                    y[line,column]=pixel[0]                        
-                    u[l,c]=pixel[1]
-                    v[l,c]=pixel[2]
-                    #
-                    self.frameY[frame]=y
-                    self.frameU[frame]=u
-                    self.frameV[frame]=v
-
-            #por cada frame
-            self.frameY+=[y]
-            self.frameU+=[u]
-            self.frameV+=[v]
+            y,u,v=codec.readFrame(0,bs,g,predictor)
+            if region!=None:
+                y,u,v=self.crop(y,u,v,region)
+
+            if frames==None:
+                yield y,u,v
+                continue
+            if frame in remaining:
+                decoded[frame]=(y,u,v)
+            while next_frame<len(frames) and frames[next_frame] in decoded:
+                f=frames[next_frame]
+                remaining[f]-=1
+                yield decoded[f] if remaining[f] else decoded.pop(f)
+                next_frame+=1
         #
         bs.close()
 
+    ## decodeFrames function
+    # @param[in] bs Bitstream class object
+    # @param[in] segments List with the tile bounds (None for whole frames) and byte offset of each segment to decode
+    # @param[in] workers Number of processes decoding segments in parallel
+    # @param[out] frames Generator of the y,u,v components of each segment, in the order of segments
+    # Segments are only handed to the workers as they are needed, a few more than workers being decoded ahead of the
+    # one taken from frames, so memory stays bounded when frames are consumed slowly
+    def decodeFrames(self,bs,segments,workers):
+        if workers<=1:
+            predictor=Predictor(self.colorSpace,self.shape)
+            for bounds,offset in segments:
+                print('decoding segment at',offset)
+                yield self.frameCopy(None,bounds).decodeFrame(bs,offset,predictor)
+            return
+
+        pool=multiprocessing.Pool(workers)
+        try:
+            pending=collections.deque()
+            for bounds,offset in segments:
+                pending.append(pool.apply_async(decodeFrameWorker,((self.frameCopy(None,bounds),offset),)))
+                while len(pending)>2*workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+    ## decodeFrame function
+    # @param[in] bs Bitstream class object
+    # @param[in] offset Byte offset of the frame
+    # @param[in] predictor Predictor class object
+    # @param[out] y,u,v Decoded frame components
+    # Chunks of container files are independent, so decoding starts with fresh adaptive Golomb statistics
+    def decodeFrame(self,bs,offset,predictor):
+        bs.seek(offset)
+        codec=self.frameCopy(None)
+        return codec.readFrame(0,bs,codec.golombCoder(),predictor)
+
+    ## readFrame function
+    # @param[in] frame Frame number
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # @param[out] y,u,v Decoded frame components
+    # Decodes all the pixel errors of a frame and recreates the original pixels based on the predictor that was used
+    def readFrame(self,frame,bs,g,predictor):
+        y=np.zeros(shape=self.shape,dtype=np.uint8)
+        u=np.zeros(shape=self.other_shape,dtype=np.uint8)
+        v=np.zeros(shape=self.other_shape,dtype=np.uint8)
+
+        if self.planar:
+            return self.decodePlanes(bs,g,predictor)
+
+        # in lossy coding of subsampled chroma, each component is reconstructed several times, the last one prevailing
+        if self.quantizationStep==None or self.colorSpace=='4:4:4':
+            erro=self.decodeResiduals(bs,g)
+            return predictor.reconstruct(erro)
+
+        self.frameY[frame]=y
+        self.frameU[frame]=u
+        self.frameV[frame]=v
+        for line in range(0, self.height):
+            for column in range(0,self.width):
+                pixel=self.decodeWithBitstream(3,bs,g)
+
+                a=self.getYUVPixel(frame,line,column-1, resized=False)
+                c=self.getYUVPixel(frame,line-1,column-1, resized=False)
+                b=self.getYUVPixel(frame,line-1,column, resized=False)
+                x=self.predict(a,c,b)
+                pixel=self.sum(x,pixel)
+
+                pixel=tuple(pixel)
+
+                l,c=self.adjustCoord(line,column)
+
+                y[line,column]=pixel[0]                        
+                u[l,c]=pixel[1]
+                v[l,c]=pixel[2]
+        return y,u,v
+
+    ## golombCoder function
+    # @param[out] g Golomb class object with the parameter of the video, or AdaptiveGolomb class object with initial statistics
+    def golombCoder(self):
+        if self.adaptive:
+            return AdaptiveGolomb(3)
+        return Golomb(self.golombParam)
+
     ## handleHeader function
     # Interpreting the header of the file, containing width, height, frames per second and color space, assigning them to class variables
     # This header can also contain other parameters added while encoding, such as the parameter for Golomb and the quantization steps used for lossy coding
@@ -159,25 +363,43 @@ class IntraCodec:
             elif c=='H':
                 self.height=int(field[1:])
             elif c=='F':
-                self.fps=int(field[1:3])
+                fps=field[1:].split(':')
+                self.fps=Fraction(int(fps[0]),int(fps[1]) if len(fps)>1 else 1)
             elif c=='C':
                 self.colorSpace=int(field[1:])
             elif c=='G':
-                self.golombParam=int(field[-1:])
+                self.golombParam=int(field[6:])
                 self.encoded=True
             elif c=='z':
                 self.TotalFrames=int(field[1:])
+            elif c=='a':
+                self.adaptive=field[1:]=='1'
+            elif c=='p':
+                self.planar=field[1:]=='1'
             elif c=='q':
                 qlist=field[1:]
                 qsteps=qlist.split(':')
                 self.quantizationStep=[int(qsteps[0]),int(qsteps[1]),int(qsteps[2])]
                     
         self.computeShape()
+        self.printHeader()
+
+    ## printHeader function
+    # Shows the parameters of the video
+    def printHeader(self):
         print('width=',self.width, 'height=',self.height, self.fps, self.colorSpace, self.frameLength)
         if self.encoded:
             print('g=',self.golombParam, 'totalframes=',self.TotalFrames)
         if self.quantizationStep!=None:
             print('q=',self.quantizationStep)
+        if self.adaptive:
+            print('adaptive golomb')
+        if self.planar:
+            print('planar coding')
+        if self.container:
+            print('container file')
+        if self.tiles!=(1,1):
+            print('tiles=',self.tiles)
     
     ## adjustCoord function
     # @param[in] line Line where the pixel is located
@@ -285,40 +507,216 @@ class IntraCodec:
     # @param[in] golombparam Golomb's parameter M (factor)
     # @param[in] q Optional parameter for specifying each components quantization steps for lossy coding
     # @param[in] limitFrames Optional parameter for limiting number of frames to encode
+    # @param[in] adaptive Optional flag for choosing the Golomb parameter of each value adaptively (golombparam is then ignored)
+    # @param[in] planar Optional flag for coding intra frames plane by plane, each component with its own shape (False for the original pixel by pixel format)
+    # @param[in] container Optional flag for writing a Container file, with each frame coded independently in its own chunk (False for the original format with a text header)
+    # @param[in] workers Optional number of processes encoding frames (or tiles) in parallel (requires container)
+    # @param[in] tiles Optional (lines,columns) grid each frame is split into, (n,1) for horizontal slices (requires planar and container)
+    # @param[in] frames Optional iterable (e.g. a generator) with the components y,u,v of each frame to encode, instead of the frames of this video
+    # Frames are encoded as they are taken from the video (or from frames) and are not kept, so any number of them can be
+    # encoded in bounded memory; when their number is not known in advance it is filled in the header at the end
     # Starts by encoding the header, passing additional parameters such as the Golomb factor
     # Proceeds to encode each pixel, by calculating each component's error according to the predictor function
-    def encode_video(self, filename, golombparam, q=None, limitFrames=None):
-        if limitFrames==None:
-            l=self.TotalFrames
+    # Tiles are predicted on their own, pixels outside the tile being 0 as outside the frame, and are written as
+    # independent chunks
+    def encode_video(self, filename, golombparam, q=None, limitFrames=None, adaptive=False, planar=True, container=True, workers=1, tiles=(1,1), frames=None):
+        if frames==None:
+            frames=self.frames(limitFrames)
+            total=self.TotalFrames if limitFrames==None else min(self.TotalFrames,limitFrames)
         else:
-            l=limitFrames
-
-        g=Golomb(golombparam)
+            frames=itertools.islice(frames,limitFrames)
+            total=None
+
+        if workers>1 and not container:
+            print('Error: parallel encoding requires a container file')
+            exit(1)
+        if tuple(tiles)!=(1,1) and not (planar and container):
+            print('Error: tiles require planar coding and a container file')
+            exit(1)
+        # split dimensions need at least 2 pixels per tile, so that subsampled chroma tiles are not empty
+        if not all(n==1 or 1<n<=length//2 for n,length in zip(tiles,(self.height,self.width))):
+            print('Error: invalid number of tiles',tiles)
+            exit(1)
+
+        self.golombParam=golombparam
+        self.adaptive=adaptive
+        self.planar=planar
+        self.container=container
+        self.tiles=tuple(tiles)
+        if q!=None:
+            self.quantizationStep=q
+        g=self.golombCoder()
 
         bs=BitStream(filename,'WRITE')
 
-        header='ENCODED '+self.header+' Golomb'+str(golombparam)+' z'+str(self.TotalFrames)
+        if container:
+            c=self.newContainer()
+            c.totalFrames=total or 0
+            c.writeHeader(bs)
+            for data in self.encodeFrames(frames,workers):
+                c.writeChunk(bs,c.INTRA,data)
+            c.writeIndex(bs)
+            # the number of frames actually written, whatever the header said
+            c.writeTotalFrames(bs,len(c.offsets)//len(self.tileBounds()))
+            bs.close()
+            return
+
+        # unknown number of frames: fixed width field, overwritten at the end
+        header='ENCODED '+self.header+' Golomb'+str(golombparam)+' z'+(str(total) if total!=None else '0'*10)
+        if adaptive:
+            header+=' a1'
+        if planar:
+            header+=' p1'
         if q!=None:
             header+=' q'+str(q[0])+':'+str(q[1])+':'+str(q[2])
-            self.quantizationStep=q
         headerlen=len(header)
         bs.write_n_bits(headerlen,8)
         bs.writeTxt(header)
 
-        for frame in range(0,l):
+        count=0
+        predictor=Predictor(self.colorSpace,self.shape)
+        for frame,planes in enumerate(frames):
             print('encoding frame',frame)
-            for line in range(0,self.height):
-                for column in range(0,self.width):
-                    p=self.getYUVPixel(frame,line,column, resized=False)
-
-                    a=self.getYUVPixel(frame,line,column-1, resized=False)
-                    c=self.getYUVPixel(frame,line-1,column-1, resized=False)
-                    b=self.getYUVPixel(frame,line-1,column, resized=False)
-                    x=self.predict(a,c,b)
-                    erro=self.diff(p,x)
-                    self.encodeWithBitstream(erro,bs,g,pixel=p,frame=frame,line=line,column=column)
+            self.frameCopy(planes).writeFrame(0,bs,g,predictor)
+            count+=1
+        if total==None and count:
+            bs.writeAt(1+header.index(' z')+2,('%010d'%count).encode())
         bs.close()
 
+    ## writeFrame function
+    # @param[in] frame Frame number
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # Encodes each pixel of the frame, by calculating each component's error according to the predictor function
+    def writeFrame(self,frame,bs,g,predictor):
+        if self.planar:
+            self.encodePlanes([self.frameY[frame],self.frameU[frame],self.frameV[frame]],bs,g,predictor)
+            return
+        if self.quantizationStep==None or self.quantizationStep==[0,0,0]:
+            # every prediction only depends on original pixels, so the whole frame is predicted at once
+            erro=predictor.residuals(self.frameY[frame],self.frameU[frame],self.frameV[frame])
+            self.encodeResiduals(erro,bs,g)
+            return
+        for line in range(0,self.height):
+            for column in range(0,self.width):
+                p=self.getYUVPixel(frame,line,column, resized=False)
+
+                a=self.getYUVPixel(frame,line,column-1, resized=False)
+                c=self.getYUVPixel(frame,line-1,column-1, resized=False)
+                b=self.getYUVPixel(frame,line-1,column, resized=False)
+                x=self.predict(a,c,b)
+                erro=self.diff(p,x)
+                self.encodeWithBitstream(erro,bs,g,pixel=p,frame=frame,line=line,column=column)
+
+    ## encodeFrame function
+    # @param[in] frame Frame number
+    # @param[out] data Bytes of the frame, coded independently of the other frames
+    def encodeFrame(self,frame):
+        out=io.BytesIO()
+        bs=BitStream(out,'WRITE')
+        self.writeFrame(frame,bs,self.golombCoder(),Predictor(self.colorSpace,self.shape))
+        bs.flush()
+        return out.getvalue()
+
+    ## frameCopy function
+    # @param[in] planes Components y,u,v of a frame (None for an empty frame, to be decoded)
+    # @param[in] bounds Optional tile (line0,line1,column0,column1) the copy is restricted to
+    # @param[out] codec Copy of this object holding only the given frame or tile (as frame 0), cheap to send to another process
+    def frameCopy(self,planes,bounds=None):
+        codec=copy.copy(self)
+        # streams cannot be sent to other processes
+        codec.reader=None
+        if hasattr(codec.vid,'read'):
+            codec.vid=None
+        if planes==None:
+            codec.frameY=[None]
+            codec.frameU=[None]
+            codec.frameV=[None]
+        else:
+            codec.frameY=[planes[0]]
+            codec.frameU=[planes[1]]
+            codec.frameV=[planes[2]]
+        if bounds!=None:
+            l0,l1,c0,c1=bounds
+            codec.shape=(l1-l0,c1-c0)
+            codec.height,codec.width=codec.shape
+            if planes!=None:
+                codec.frameY=[codec.frameY[0][l0:l1,c0:c1]]
+            l0,l1,c0,c1=self.chromaBounds(bounds)
+            codec.other_shape=(l1-l0,c1-c0)
+            if planes!=None:
+                codec.frameU=[codec.frameU[0][l0:l1,c0:c1]]
+                codec.frameV=[codec.frameV[0][l0:l1,c0:c1]]
+        return codec
+
+    ## tileBounds function
+    # @param[out] bounds List with the (line0,line1,column0,column1) of each tile, in coding order ([None] if frames are not split)
+    # Tile limits are kept even so that they are also limits between chroma samples
+    def tileBounds(self):
+        if self.tiles==(1,1):
+            return [None]
+        h,w=self.shape
+        lines=[(i*h//self.tiles[0])&~1 for i in range(0,self.tiles[0])]+[h]
+        columns=[(j*w//self.tiles[1])&~1 for j in range(0,self.tiles[1])]+[w]
+        return [(lines[i],lines[i+1],columns[j],columns[j+1]) for i in range(0,self.tiles[0]) for j in range(0,self.tiles[1])]
+
+    ## chromaBounds function
+    # @param[in] bounds Region (line0,line1,column0,column1) of the Y component
+    # @param[out] bounds Same region in the U and V components
+    def chromaBounds(self,bounds):
+        l0,l1,c0,c1=bounds
+        sl=2 if self.colorSpace=='4:2:0' else 1
+        sc=1 if self.colorSpace=='4:4:4' else 2
+        return l0//sl,min(-(-l1//sl),self.other_shape[0]),c0//sc,min(-(-c1//sc),self.other_shape[1])
+
+    ## overlaps function
+    # @param[in] bounds Tile bounds (None for the whole frame)
+    # @param[in] region Region (line0,line1,column0,column1)
+    # @param[out] flag True if the tile and the region have pixels in common
+    def overlaps(self,bounds,region):
+        if bounds==None:
+            return True
+        return bounds[0]<region[1] and region[0]<bounds[1] and bounds[2]<region[3] and region[2]<bounds[3]
+
+    ## crop function
+    # @param[in] y,u,v Frame components
+    # @param[in] region Region (line0,line1,column0,column1) of the Y component
+    # @param[out] y,u,v Components cropped to the region
+    def crop(self,y,u,v,region):
+        l0,l1,c0,c1=region
+        y=y[l0:l1,c0:c1]
+        l0,l1,c0,c1=self.chromaBounds(region)
+        return y,u[l0:l1,c0:c1],v[l0:l1,c0:c1]
+
+    ## encodeFrames function
+    # @param[in] frames Iterable with the components y,u,v of each frame to encode
+    # @param[in] workers Number of processes encoding frames in parallel
+    # @param[out] data Generator of the bytes of each frame (or of each tile of each frame), in order
+    # Frames are only taken from frames as they are needed, a few more than workers being in memory at a time
+    def encodeFrames(self,frames,workers):
+        bounds=self.tileBounds()
+        if workers<=1:
+            for frame,planes in enumerate(frames):
+                print('encoding frame',frame)
+                for b in bounds:
+                    yield self.frameCopy(planes,b).encodeFrame(0)
+            return
+
+        pool=multiprocessing.Pool(workers)
+        try:
+            pending=collections.deque()
+            for frame,planes in enumerate(frames):
+                print('encoding frame',frame)
+                for b in bounds:
+                    pending.append(pool.apply_async(encodeFrameWorker,(self.frameCopy(planes,b),)))
+                while len(pending)>2*workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
     ## predict function
     # @param[in] a Adjacent pixel in position (line,col-1)
     # @param[in] c  Adjacent pixel in position (line-1,col-1)
@@ -405,56 +803,131 @@ class IntraCodec:
     # @param[in] frame Frame where the pixel being encoded is located
     # @param[in] line Line where the pixel being encoded is located
     # @param[in] column Column where the pixel being encoded is located
+    # @param[in] context First context used by the adaptive Golomb coder (one per value, 0-2 for pixel components)
     # Switches the value to be encoded to positive, writing a 1 or 0 according to the original value
     # If using lossy coding functionality, divides color component by quantization step and updates pixel value
     # Proceeds to write the encoded value by Golomb with the Bitstream
-    def encodeWithBitstream(self, value,bs,g, pixel=None, frame=None, line=None, column=None):
+    def encodeWithBitstream(self, value,bs,g, pixel=None, frame=None, line=None, column=None, context=0):
         for i in range(0,len(value)):
-            if value[i]<0:
-                n=value[i]*-1
-                bs.writebits(1,1)
-            else:
-                bs.writebits(0,1)
-                n=value[i]
-            
+            coder=g
+            if self.adaptive:
+                coder=g.coder(context+i)
+
             if self.quantizationStep!=None and self.quantizationStep[i]!=0:
+                n=abs(int(value[i]))
+                bs.writebits(1 if value[i]<0 else 0,1)
+
                 newValue=pixel[i]+(n)
                 n=math.floor(n/self.quantizationStep[i])
                 
                 #TODO
                 if line!=0 and column!=0:
                     self.updateYUVPixel(i,frame,line,column,newValue)
-            n=g.encode(n)
-            bs.writebits(int(n,2),len(n))
+                bs.write_golomb(n,coder,signed=False)
+            else:
+                n=int(value[i])
+                bs.write_golomb(n,coder)
+
+            if self.adaptive:
+                g.update(context+i,n)
+
+    ## encodeResiduals function
+    # @param[in] erro Array with the errors of every pixel component of a frame (lossless coding)
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # Writes the same values as calling encodeWithBitstream pixel by pixel, packing the whole array at once
+    # unless the Golomb parameter is adaptive
+    def encodeResiduals(self,erro,bs,g):
+        if self.adaptive:
+            for pixel in erro.reshape(-1,3).tolist():
+                self.encodeWithBitstream(pixel,bs,g)
+        else:
+            bs.write_golomb_array(erro,g)
+
+    ## encodePlanes function
+    # @param[in] planes List with the Y, U and V components of a frame
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # @param[out] planes Components as the decoder will reconstruct them
+    # Planar coding: each component is predicted from its own neighbours, with its own shape, and all its errors
+    # are written before the next component's
+    # In lossy coding the errors are quantized and pixels are predicted from reconstructed pixels
+    def encodePlanes(self,planes,bs,g,predictor):
+        planes=list(planes)
+        for i in range(0,3):
+            if self.quantizationStep!=None and self.quantizationStep[i]!=0:
+                erro,planes[i]=predictor.quantizePlane(planes[i],self.quantizationStep[i])
+            else:
+                erro=predictor.planeResiduals(planes[i])
+
+            if self.adaptive:
+                for value in erro.ravel().tolist():
+                    bs.write_golomb(value,g.coder(i))
+                    g.update(i,value)
+            else:
+                bs.write_golomb_array(erro,g)
+        return planes
 
     ## decodeWithBitStream function
     # @param[in] len Number of values to read
     # @param[in] bs Bitstream class object
     # @param[in] g Golomb class object
-    # @param[in] bitsResto Number of bits of the remainder = log(factor,2)
+    # @param[in] context First context used by the adaptive Golomb coder
     # @param[out] pixel Decoded value
-    # Starts by reading one bit 0 or 1, determing if number was negative
-    # Reads the bits from the Bitstream and decodes them with Golomb
+    # Reads each value (sign bit and Golomb code) directly from the Bitstream
     # Multiplies by quantization step if using lossy coding
-    def decodeWithBitstream(self, len,bs,g,bitsResto):
+    def decodeWithBitstream(self, len,bs,g,context=0):
         pixel=[]
         for i in range(0,len):
-            ay=bs.read_n_bits(1)
-            seq=''
-            while True:
-                r=str(bs.read_n_bits(1))
-                seq+=r
-                if r=='0':
-                    break
-            seq+=str(bs.readbits(bitsResto))
-            comp=g.decode(seq)
-            if ay==1:
-                comp=comp*-1
+            if self.adaptive:
+                comp=bs.read_golomb(g.coder(context+i))
+                g.update(context+i,comp)
+            else:
+                comp=bs.read_golomb(g)
             if self.quantizationStep!=None and self.quantizationStep[i]!=0:
                 comp=comp*self.quantizationStep[i]
             pixel.append(comp)
         return pixel
 
+    ## decodeResiduals function
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[out] erro Array (height,width,3) with the errors of every pixel component of a frame
+    # Reads the same values as calling decodeWithBitstream pixel by pixel, all at once unless the Golomb parameter is adaptive
+    def decodeResiduals(self,bs,g):
+        if self.adaptive:
+            erro=[self.decodeWithBitstream(3,bs,g) for i in range(0,self.height*self.width)]
+            return np.array(erro,dtype=np.int64).reshape(self.height,self.width,3)
+
+        erro=bs.read_golomb_array(self.height*self.width*3,g).reshape(self.height,self.width,3)
+        if self.quantizationStep!=None:
+            erro*=[step if step!=0 else 1 for step in self.quantizationStep]
+        return erro
+
+    ## decodePlanes function
+    # @param[in] bs Bitstream class object
+    # @param[in] g Golomb class object
+    # @param[in] predictor Predictor class object
+    # @param[out] planes Y, U and V components of a frame written with planar coding
+    def decodePlanes(self,bs,g,predictor):
+        planes=[]
+        for i,shape in enumerate([self.shape,self.other_shape,self.other_shape]):
+            count=shape[0]*shape[1]
+            if self.adaptive:
+                erro=np.zeros(shape=count,dtype=np.int64)
+                for j in range(0,count):
+                    erro[j]=bs.read_golomb(g.coder(i))
+                    g.update(i,int(erro[j]))
+            else:
+                erro=bs.read_golomb_array(count,g)
+
+            step=0
+            if self.quantizationStep!=None:
+                step=self.quantizationStep[i]
+            planes.append(predictor.reconstructPlane(erro.reshape(shape),step))
+        return planes
+
     ## verifyData function
     # @param[in] video Class containing video for comparison
     # @param[in] numberoframes Limits number of frames to check
@@ -472,3 +945,22 @@ class IntraCodec:
             if (np.array_equal(m3[i],m6[i])):
                 print('V-',i,'correct')
 
+
+## encodeFrameWorker function
+# @param[in] codec IntraCodec holding a single frame or tile (see frameCopy)
+# @param[out] data Bytes of the frame or tile
+# Run by each process of the pool in parallel encoding
+def encodeFrameWorker(codec):
+    return codec.encodeFrame(0)
+
+
+## decodeFrameWorker function
+# @param[in] job Pair with an IntraCodec without frames (see frameCopy) and the byte offset of the frame to decode
+# @param[out] y,u,v Decoded frame components
+# Run by each process of the pool in parallel decoding, each one reading the file on its own
+def decodeFrameWorker(job):
+    codec,offset=job
+    bs=BitStream(codec.vid,'READ')
+    frame=codec.decodeFrame(bs,offset,Predictor(codec.colorSpace,codec.shape))
+    bs.close()
+    return frame
@@ -0,0 +1,342 @@
+## @class MotionEstimator
+# Block motion search used by the HybridCodec for inter frames
+# For every block of a frame, the most similar block of the reference frame (least sum of absolute differences
+# of all the pixel components, SAD) is found among the blocks within the search area
+# Instead of comparing the candidates one at a time, the candidates of every block of a line of blocks are
+# taken as a sliding window view of the (padded) blocks of the reference frame, and all their SADs are
+# computed with a single NumPy reduction
+# Differences are computed with integers wider than the pixels, so they never wrap around
+# Motion can also be searched with pixel accuracy (searchPixels): vectors are then displacements, in pixels, of
+# each block, within the search area (in pixels), and candidates are found with one of the search methods:
+# 'full' (every displacement), 'three_step', 'diamond' or 'hexagon'. The fast methods move every block towards
+# its best candidate at the same time, evaluating a fixed pattern of displacements around the current one, so
+# their work grows with the length of the motion instead of the square of the search area
+# Vectors can be coded as differences to a prediction, the median of the vectors (as displacements) of the blocks
+# to the left, top and top right (top left in the last column), as in H.264; vectors of neighbouring blocks are
+# usually alike, so the differences are small
+# The search of a block stops as soon as its SAD is not above a threshold (early termination), the displacement of
+# the same block in the previous frame and no displacement being tried first. The SAD of the other candidates is
+# computed a few lines at a time (see parts), and a candidate is dropped as soon as its partial SAD is above the best
+# SAD of the block so far (pruning), which can only drop candidates that would not have been chosen. The work done is
+# counted in stats
+# @author Tiago Melo 89005
+# @author João Nogueira 89262
+
+import collections
+import numpy as np
+
+class MotionEstimator:
+
+    methods=['full','three_step','diamond','hexagon']
+
+    # patterns of the fast search methods (the current displacement is the center)
+    largeDiamond=[(-2,0),(-1,-1),(-1,1),(0,-2),(0,2),(1,-1),(1,1),(2,0)]
+    smallDiamond=[(-1,0),(0,-1),(0,1),(1,0)]
+    hexagon=[(-2,0),(-1,-2),(-1,2),(1,-2),(1,2),(2,0)]
+
+    ## Initialization function
+    # @param[in] block_size Block's length
+    # @param[in] search_area Search area, in blocks (search) or in pixels (searchPixels), around the position of each block
+    # @param[in] method Optional search method for searchPixels ('full', 'three_step', 'diamond' or 'hexagon')
+    # @param[in] stop Optional SAD at or below which the search of a block stops (None for searching every candidate)
+    def __init__(self, block_size, search_area, method='full', stop=None):
+        if method not in self.methods:
+            print('Error: unknown motion search method',method)
+            exit(1)
+        self.block_size=block_size
+        self.search_area=search_area
+        self.method=method
+        self.stop=stop
+
+        # blocks searched, candidates evaluated, candidates pruned after their partial SAD and blocks that stopped early
+        self.stats=collections.Counter()
+
+    ## search function
+    # @param[in] blocks Array (lines,columns,block_size,block_size,3) with the blocks of the frame
+    # @param[in] oldBlocks Array with the same shape with the blocks of the reference frame
+    # @param[in] previous Optional array (lines,columns,2) with the displacement, in blocks, of each block in the previous frame
+    # @param[out] vectors Array (lines,columns,2) with the position of the most similar block of the reference frame to each block
+    # @param[out] residuals Array (lines,columns,block_size,block_size,3) with the differences between each block and that block
+    # Ties are resolved as in the original search: the first candidate (line by line) with the least SAD is chosen,
+    # unless the block at the same position (or else at the previous displacement) has a SAD not above stop, in which
+    # case no other candidate is evaluated. Those two candidates are evaluated first, and their least SAD is the bound
+    # the other candidates are pruned against
+    def search(self, blocks, oldBlocks, previous=None):
+        s=self.search_area
+        bl,bc=blocks.shape[:2]
+        side=2*s+1
+
+        blocks=blocks.astype(np.int16)
+        oldBlocks=oldBlocks.astype(np.int16)
+        self.stats['blocks']+=bl*bc
+        positions=np.indices((bl,bc)).transpose(1,2,0)
+        vectors=positions.copy()
+        best=np.abs(blocks-oldBlocks).sum(axis=(2,3,4),dtype=np.int64)
+        self.stats['candidates']+=bl*bc
+        stopped=self.stopped(best)
+        if previous is not None:
+            seeds=positions+previous
+            seeded=~stopped & (np.abs(previous)<=s).all(axis=2) & (seeds>=0).all(axis=2) & (seeds<(bl,bc)).all(axis=2)
+            index=np.nonzero(seeded)
+            sad=np.abs(blocks[index]-oldBlocks[seeds[index][:,0],seeds[index][:,1]]).sum(axis=(1,2,3),dtype=np.int64)
+            self.stats['candidates']+=len(sad)
+            better=sad<best[index]
+            index=(index[0][better],index[1][better])
+            vectors[index]=seeds[index]
+            best[index]=sad[better]
+            stopped=self.stopped(best)
+        self.stats['stopped']+=int(stopped.sum())
+        # candidates outside the frame are blocks of padding, excluded by their position
+        padded=np.pad(oldBlocks,((s,s),(s,s),(0,0),(0,0),(0,0)))
+        windows=np.lib.stride_tricks.sliding_window_view(padded,(side,side),axis=(0,1))
+
+        offsets=np.arange(-s,s+1)
+        validColumns=((np.arange(0,bc)[:,None]+offsets)>=0) & ((np.arange(0,bc)[:,None]+offsets)<bc)
+
+        for l in range(0,bl):
+            columns=np.nonzero(~stopped[l])[0]
+            if len(columns)==0:
+                continue
+            lineBlocks=blocks[l][columns]
+            valid=((l+offsets>=0) & (l+offsets<bl))[None,:,None] & validColumns[columns][:,None,:]
+            self.stats['candidates']+=int(valid.sum())
+            # the best candidate is never above the bound, so dropping those above it keeps the first one with the least SAD
+            bound=best[l,columns]
+            # the first part of every candidate, (columns,lines,block_size,3,side,side), is compared at once, the other
+            # parts only for the candidates still searching
+            parts=self.parts()
+            start,end=parts[0]
+            sad=np.abs(windows[l][columns,start:end]-lineBlocks[:,start:end,...,None,None]).sum(axis=(1,2,3),dtype=np.int64).ravel()
+            rest=np.nonzero(valid.ravel())[0]
+            for start,end in parts[1:]:
+                rest=rest[sad[rest]<=bound[rest//(side*side)]]
+                column,offset=np.divmod(rest,side*side)
+                dl,dc=np.divmod(offset,side)
+                sad[rest]+=np.abs(padded[l+dl,columns[column]+dc,start:end]-lineBlocks[column,start:end]).sum(axis=(1,2,3),dtype=np.int64)
+            self.stats['pruned']+=int(valid.sum())-len(rest)
+            searched=np.full(shape=sad.shape,fill_value=np.iinfo(np.int64).max,dtype=np.int64)
+            searched[rest]=sad[rest]
+            found=searched.reshape(len(columns),-1).argmin(axis=1)
+            vectors[l,columns,0]=l+found//side-s
+            vectors[l,columns,1]=columns+found%side-s
+
+        residuals=blocks-oldBlocks[vectors[...,0],vectors[...,1]]
+        return vectors,residuals
+
+    ## searchPixels function
+    # @param[in] pixels Array (height,width,3) with the pixels of the frame
+    # @param[in] reference Array with the same shape with the pixels of the reference frame
+    # @param[in] previous Optional array (lines,columns,2) with the displacement of each block in the previous frame, tried first
+    # @param[out] vectors Array (lines,columns,2) with the displacement (line,column), in pixels, of the most similar block of the reference frame to each block
+    # @param[out] residuals Array (lines,columns,block_size,block_size,3) with the differences between each block and that block
+    # Only displacements within the search area and the coded part of the frame (whole blocks) are considered, as the
+    # decoder has nothing else to refer to; ties keep the displacement found first, starting with no displacement and
+    # then the previous one
+    def searchPixels(self, pixels, reference, previous=None):
+        length=self.block_size
+        bl,bc=pixels.shape[0]//length,pixels.shape[1]//length
+        self.blocks=pixels[:bl*length,:bc*length].reshape(bl,length,bc,length,3).swapaxes(1,2).astype(np.int16)
+        self.windows=self.referenceWindows(reference[:bl*length,:bc*length])
+
+        lines,columns=np.meshgrid(np.arange(0,bl),np.arange(0,bc),indexing='ij')
+        self.lines,self.columns=lines.ravel(),columns.ravel()
+
+        self.stats['blocks']+=bl*bc
+        vectors=np.zeros(shape=(bl*bc,2),dtype=np.int64)
+        sad=self.cost(np.arange(0,bl*bc),vectors)
+        active=self.searching(sad,np.ones(shape=bl*bc,dtype=bool))
+        if previous is not None:
+            vectors,sad=self.moveBest(vectors,sad,[(0,0)],active,previous.reshape(bl*bc,2))
+            active=self.searching(sad,active)
+
+        r=self.search_area
+        if self.method=='full':
+            offsets=[(dl,dc) for dl in range(-r,r+1) for dc in range(-r,r+1) if dl or dc]
+            vectors,sad=self.moveBest(vectors,sad,offsets,active,np.zeros(shape=(bl*bc,2),dtype=np.int64))
+        elif self.method=='three_step':
+            step=1<<(r.bit_length()-1) if r>0 else 0
+            while step>=1:
+                offsets=[(dl*step,dc*step) for dl in (-1,0,1) for dc in (-1,0,1) if dl or dc]
+                vectors,sad=self.moveBest(vectors,sad,offsets,active)
+                active=self.searching(sad,active)
+                step//=2
+        else:
+            pattern=self.largeDiamond if self.method=='diamond' else self.hexagon
+            vectors,sad=self.patternSearch(vectors,sad,pattern,active)
+            vectors,sad=self.moveBest(vectors,sad,self.smallDiamond,self.searching(sad,active))
+
+        if self.stop!=None:
+            self.stats['stopped']+=int((sad<=self.stop).sum())
+        vectors=vectors.reshape(bl,bc,2)
+        residuals=self.blocks-self.blocksAt(self.windows,vectors)
+        return vectors,residuals
+
+    ## referenceWindows function
+    # @param[in] reference Array (height,width,3) with the pixels of the reference frame
+    # @param[out] windows View (height-block_size+1,width-block_size+1,block_size,block_size,3) with the block starting at every pixel
+    def referenceWindows(self, reference):
+        windows=np.lib.stride_tricks.sliding_window_view(reference,(self.block_size,self.block_size),axis=(0,1))
+        return np.moveaxis(windows,2,4)
+
+    ## blocksAt function
+    # @param[in] windows Blocks of the reference frame (see referenceWindows)
+    # @param[in] vectors Array (lines,columns,2) with the displacement of each block
+    # @param[out] blocks Array (lines,columns,block_size,block_size,3) with the blocks of the reference frame at those displacements
+    def blocksAt(self, windows, vectors):
+        bl,bc=vectors.shape[:2]
+        lines=np.arange(0,bl)[:,None]*self.block_size+vectors[...,0]
+        columns=np.arange(0,bc)[None,:]*self.block_size+vectors[...,1]
+        return windows[lines,columns].astype(np.int16)
+
+    ## cost function
+    # @param[in] index Numbers of the blocks (line by line)
+    # @param[in] vectors Array (len(index),2) with a displacement for each one of those blocks
+    # @param[in] bound Optional array with the best SAD of each one of those blocks so far, for pruning
+    # @param[out] sad Sum of absolute differences between each block and the block of the reference frame at its displacement
+    # (largest integer for displacements outside the search area or the frame, only the partial SAD, which is not below
+    # the bound, for pruned candidates)
+    def cost(self, index, vectors, bound=None):
+        length=self.block_size
+        lines=self.lines[index]*length+vectors[:,0]
+        columns=self.columns[index]*length+vectors[:,1]
+        valid=(np.abs(vectors)<=self.search_area).all(axis=1)
+        valid&=(lines>=0) & (lines<self.windows.shape[0]) & (columns>=0) & (columns<self.windows.shape[1])
+
+        sad=np.full(shape=len(index),fill_value=np.iinfo(np.int64).max,dtype=np.int64)
+        valid=np.nonzero(valid)[0]
+        self.stats['candidates']+=len(valid)
+        if len(valid)==0:
+            return sad
+
+        lines,columns=lines[valid],columns[valid]
+        blocks=self.blocks[self.lines[index[valid]],self.columns[index[valid]]]
+        if bound is None:
+            sad[valid]=np.abs(self.windows[lines,columns].astype(np.int16)-blocks).sum(axis=(1,2,3),dtype=np.int64)
+            return sad
+
+        sad[valid]=0
+        rest=np.arange(0,len(valid))
+        for start,end in self.parts():
+            rest=rest[sad[valid[rest]]<bound[valid[rest]]]
+            sad[valid[rest]]+=np.abs(self.windows[lines[rest],columns[rest],start:end].astype(np.int16)-blocks[rest,start:end]).sum(axis=(1,2,3),dtype=np.int64)
+        self.stats['pruned']+=len(valid)-len(rest)
+        return sad
+
+    ## parts function
+    # @param[out] parts List of (first,last+1) lines of a block, in which the partial SAD of the candidates is computed
+    # Half of the lines come first, then half of the remaining ones and so on, so that candidates are checked against
+    # the bound more often as their partial SAD gets closer to their SAD, with few (vectorized) steps
+    def parts(self):
+        parts=[]
+        start=0
+        while start<self.block_size:
+            end=start+(self.block_size-start+1)//2
+            parts.append((start,end))
+            start=end
+        return parts
+
+    ## stopped function
+    # @param[in] sad Array with the best SAD of each block so far
+    # @param[out] stopped Array of flags of the blocks whose SAD is not above stop
+    def stopped(self, sad):
+        if self.stop==None:
+            return np.zeros(shape=sad.shape,dtype=bool)
+        return sad<=self.stop
+
+    ## searching function
+    # @param[in] sad Array with the best SAD of each block so far
+    # @param[in] active Array of flags of the blocks being searched
+    # @param[out] active Array of flags of the blocks still being searched, without those whose SAD is not above stop
+    def searching(self, sad, active):
+        if self.stop==None:
+            return active
+        return active & (sad>self.stop)
+
+    ## moveBest function
+    # @param[in] vectors Array (blocks,2) with the current displacement of each block
+    # @param[in] sad Array with the SAD of each block at its current displacement
+    # @param[in] offsets List of offsets (line,column) to the current displacement to be evaluated
+    # @param[in] active Array of flags of the blocks to be evaluated
+    # @param[in] centers Optional array (blocks,2) with the displacements the offsets are added to, instead of the current ones
+    # @param[out] vectors,sad Displacement with the least SAD of each block, among the current one and the evaluated ones, and its SAD
+    # Blocks whose SAD gets to stop are not evaluated any further
+    def moveBest(self, vectors, sad, offsets, active, centers=None):
+        if centers is None:
+            centers=vectors
+        index=np.nonzero(active)[0]
+        center=centers[index]
+        best=vectors.copy()
+        sad=sad.copy()
+        for offset in offsets:
+            if len(index)==0:
+                break
+            candidates=center+offset
+            candidateSad=self.cost(index,candidates,sad[index])
+            better=candidateSad<sad[index]
+            best[index[better]]=candidates[better]
+            sad[index[better]]=candidateSad[better]
+            if self.stop!=None and better.any():
+                searching=sad[index]>self.stop
+                index,center=index[searching],center[searching]
+        return best,sad
+
+    ## patternSearch function
+    # @param[in] vectors Array (blocks,2) with the initial displacement of each block
+    # @param[in] sad Array with the SAD of each block at that displacement
+    # @param[in] pattern List of offsets around the current displacement
+    # @param[in] active Array of flags of the blocks to be searched
+    # @param[out] vectors,sad Displacement of each block when none of the offsets of the pattern is better, and its SAD
+    def patternSearch(self, vectors, sad, pattern, active):
+        while active.any():
+            moved,sad=self.moveBest(vectors,sad,pattern,active)
+            active=self.searching(sad,active & (moved!=vectors).any(axis=1))
+            vectors=moved
+        return vectors,sad
+
+    ## displacements function
+    # @param[in] vectors Array (lines,columns,2) with the position of a block of the reference frame for each block (see search)
+    # @param[out] vectors Array with the displacement, in blocks, of each one of those blocks
+    def displacements(self, vectors):
+        return vectors-np.indices(vectors.shape[:2]).transpose(1,2,0)
+
+    ## positions function
+    # @param[in] vectors Array (lines,columns,2) with the displacement, in blocks, of a block of the reference frame for each block
+    # @param[out] vectors Array with the position of each one of those blocks
+    def positions(self, vectors):
+        return vectors+np.indices(vectors.shape[:2]).transpose(1,2,0)
+
+    ## vectorDifferences function
+    # @param[in] vectors Array (lines,columns,2) with the displacement of each block
+    # @param[out] differences Array with the difference of each displacement to its median prediction
+    # Every prediction only depends on known vectors, so all of them are computed at once
+    def vectorDifferences(self, vectors):
+        bl,bc=vectors.shape[:2]
+        padded=np.zeros(shape=(bl+1,bc+2,2),dtype=np.int64)
+        padded[1:,1:-1]=vectors
+        left=padded[1:,:-2]
+        top=padded[:-1,1:-1]
+        topRight=padded[:-1,2:].copy()
+        topRight[:,-1]=padded[:-1,-3]
+        prediction=np.median(np.stack((left,top,topRight)),axis=0).astype(np.int64)
+        # in the first line only the block to the left is known
+        prediction[0]=left[0]
+        return vectors-prediction
+
+    ## addPredictions function
+    # @param[in] differences Array (lines,columns,2) with the difference of each displacement to its median prediction
+    # @param[out] vectors Array with the displacement of each block
+    # Predictions depend on the vectors to the left, so they are found block by block
+    def addPredictions(self, differences):
+        bl,bc=differences.shape[:2]
+        vectors=np.zeros(shape=(bl,bc,2),dtype=np.int64)
+        for l in range(0,bl):
+            for c in range(0,bc):
+                left=vectors[l,c-1] if c>0 else (0,0)
+                if l==0:
+                    prediction=left
+                else:
+                    top=vectors[l-1,c]
+                    topRight=vectors[l-1,c+1] if c+1<bc else (vectors[l-1,c-1] if c>0 else (0,0))
+                    prediction=[sorted(component)[1] for component in zip(left,top,topRight)]
+                vectors[l,c]=differences[l,c]+prediction
+        return vectors
@@ -0,0 +1,143 @@
+## @class Predictor
+# Whole-frame version of the JPEG-LS non-linear predictor used by the Codecs
+# Instead of predicting pixel by pixel, the neighbours of every pixel are obtained as shifted views of
+# the frame and the prediction is computed for all of them at once with NumPy
+# Pixels are predicted exactly as with getYUVPixel/predict: chroma components are taken at luma
+# resolution and pixels outside the frame are 0
+# Decoding is done in wavefront order: all pixels in the same anti-diagonal (line+column=k) only
+# depend on pixels of previous anti-diagonals, so each anti-diagonal is reconstructed at once
+# Besides the interleaved (pixel by pixel) layout, single planes can be predicted with their own shape
+# and neighbours (planar coding), in which case lossy coding also predicts from reconstructed pixels
+# @author Tiago Melo 89005
+# @author João Nogueira 89262
+
+import numpy as np
+
+class Predictor:
+
+    ## Initialization function
+    # @param[in] colorSpace Color space of the frames ('4:4:4', '4:2:2' or '4:2:0')
+    # @param[in] shape Shape of the Y component
+    def __init__(self, colorSpace, shape):
+        self.colorSpace=colorSpace
+        self.shape=shape
+
+        # anti-diagonal indexes, by plane shape
+        self.diagonalIndexes={}
+
+    ## toLuma function
+    # @param[in] plane U or V component
+    # @param[out] plane Component with the shape of Y, each sample repeated as in getYUVPixel
+    def toLuma(self,plane):
+        if self.colorSpace=='4:2:2':
+            plane=plane.repeat(2,axis=1)
+        elif self.colorSpace=='4:2:0':
+            plane=plane.repeat(2,axis=0).repeat(2,axis=1)
+        return plane[:self.shape[0],:self.shape[1]]
+
+    ## fromLuma function
+    # @param[in] plane U or V component with the shape of Y
+    # @param[out] plane Component with its own (subsampled) shape
+    def fromLuma(self,plane):
+        if self.colorSpace=='4:2:2':
+            plane=plane[:,::2]
+        elif self.colorSpace=='4:2:0':
+            plane=plane[::2,::2]
+        return plane.copy()
+
+    ## stack function
+    # @param[in] y,u,v Frame components
+    # @param[out] frame Array (height+1,width+1,3) with the pixels of the frame, preceded by a line and a column of 0's
+    def stack(self,y,u,v):
+        h,w=self.shape
+        frame=np.zeros(shape=(h+1,w+1,3),dtype=np.int32)
+        frame[1:,1:,0]=y
+        frame[1:,1:,1]=self.toLuma(u)
+        frame[1:,1:,2]=self.toLuma(v)
+        return frame
+
+    ## predict function
+    # @param[in] a Adjacent pixels in position (line,col-1)
+    # @param[in] c  Adjacent pixels in position (line-1,col-1)
+    # @param[in] b  Adjacent pixels in position (line-1,col)
+    # @param[out] x Predicted pixels
+    # JPEG-LS non-linear predictor, for arrays of pixels
+    def predict(self,a,c,b):
+        mn=np.minimum(a,b)
+        mx=np.maximum(a,b)
+        return np.where(c>=mx,mn,np.where(c<=mn,mx,a+b-c))
+
+    ## residuals function
+    # @param[in] y,u,v Frame components
+    # @param[out] erro Array (height,width,3) with the prediction error of each pixel component
+    # The errors are in the same order as they are encoded by the Codecs (pixel by pixel, Y U V)
+    def residuals(self,y,u,v):
+        return self.planeResiduals(self.stack(y,u,v)[1:,1:])
+
+    ## reconstruct function
+    # @param[in] erro Array (height,width,3) with the prediction error of each pixel component
+    # @param[out] y,u,v Frame components
+    def reconstruct(self,erro):
+        frame=self.reconstructPlane(erro)
+        return frame[:,:,0].copy(),self.fromLuma(frame[:,:,1]),self.fromLuma(frame[:,:,2])
+
+    ## planeResiduals function
+    # @param[in] plane Array (height,width) or (height,width,components) of pixels
+    # @param[out] erro Prediction error of each pixel, predicted from its neighbours in the same array
+    def planeResiduals(self,plane):
+        h,w=plane.shape[:2]
+        frame=np.zeros(shape=(h+1,w+1)+plane.shape[2:],dtype=np.int32)
+        frame[1:,1:]=plane
+        x=frame[1:,1:]
+        a=frame[1:,:-1]
+        c=frame[:-1,:-1]
+        b=frame[:-1,1:]
+        return x-self.predict(a,c,b)
+
+    ## diagonals function
+    # @param[in] h,w Shape of the plane
+    # @param[out] indexes List with the (lines,columns) of the pixels of each anti-diagonal
+    def diagonals(self,h,w):
+        if (h,w) not in self.diagonalIndexes:
+            indexes=[]
+            for k in range(0,h+w-1):
+                lines=np.arange(max(0,k-w+1),min(h-1,k)+1)
+                indexes.append((lines,k-lines))
+            self.diagonalIndexes[(h,w)]=indexes
+        return self.diagonalIndexes[(h,w)]
+
+    ## reconstructPlane function
+    # @param[in] erro Array (height,width) or (height,width,components) with the prediction error of each pixel
+    # @param[in] step Optional quantization step the errors were divided by
+    # @param[out] plane Reconstructed pixels (uint8)
+    # Reconstructs one anti-diagonal at a time (height+width-1 steps instead of height*width)
+    # Lossless values are kept in 0..255 the same way as when they are stored in a uint8 array, lossy ones are clipped
+    def reconstructPlane(self,erro,step=0):
+        h,w=erro.shape[:2]
+        frame=np.zeros(shape=(h+1,w+1)+erro.shape[2:],dtype=np.int32)
+        for lines,cols in self.diagonals(h,w):
+            x=self.predict(frame[lines+1,cols],frame[lines,cols],frame[lines,cols+1])
+            if step:
+                frame[lines+1,cols+1]=np.clip(x+erro[lines,cols]*step,0,255)
+            else:
+                frame[lines+1,cols+1]=(x+erro[lines,cols])&255
+        return frame[1:,1:].astype(np.uint8)
+
+    ## quantizePlane function
+    # @param[in] plane Array (height,width) of pixels
+    # @param[in] step Quantization step
+    # @param[out] erro Quantized prediction error of each pixel
+    # @param[out] plane Reconstructed pixels, as the decoder will obtain them
+    # Pixels are predicted from already reconstructed pixels, so that quantization errors do not propagate
+    # Done in wavefront order, as in reconstructPlane
+    def quantizePlane(self,plane,step):
+        h,w=plane.shape
+        frame=np.zeros(shape=(h+1,w+1),dtype=np.int32)
+        erro=np.zeros(shape=(h,w),dtype=np.int64)
+        for lines,cols in self.diagonals(h,w):
+            x=self.predict(frame[lines+1,cols],frame[lines,cols],frame[lines,cols+1])
+            e=plane[lines,cols]-x
+            e=np.sign(e)*(np.abs(e)//step)
+            erro[lines,cols]=e
+            frame[lines+1,cols+1]=np.clip(x+e*step,0,255)
+        return erro,frame[1:,1:].astype(np.uint8)
@@ -5,8 +5,10 @@
 # @author João Nogueira 89262
 
 import numpy as np
+from FrameSource import *
 import cv2
 import math
+from fractions import Fraction
 
 class VideoPlayer:
     ## Initialization function
@@ -46,43 +48,16 @@ class VideoPlayer:
 
     ## read_video function
     # Reads YUV video information from file, storing all its data in our structures, calculating different components lengths and shapes
+    # Frames are not read here: the file is memory mapped and each component is read when it is first used (see FrameSource)
     def read_video(self):
-        f=open(self.vid,"rb")
-        c=1
+        source=FrameSource(self.vid,self.encoding)
+        self.header=source.header
+        self.handleHeader()
 
-        for line in f:
-
-            # Processing header
-            if c==1:
-                line=line.decode(self.encoding)
-                self.header=line.strip()
-                self.handleHeader()
-            
-            # Rest of the video
-            if c>=2:
-
-                frameY=f.read(self.yLength)
-                frameU=f.read(self.uLength)
-                frameV=f.read(self.vLength)
-
-                y=np.frombuffer(frameY, dtype=np.uint8)
-                u=np.frombuffer(frameU, dtype=np.uint8)
-                v=np.frombuffer(frameV, dtype=np.uint8)
-
-                y=y.reshape(self.shape)
-                u=u.reshape(self.other_shape)
-                v=v.reshape(self.other_shape)
-
-                self.frameY+=[y]
-                self.frameU+=[u]
-                self.frameV+=[v]
-
-            c+=1
+        self.frameY,self.frameU,self.frameV=source.planes(self.shape,self.other_shape)
 
         self.TotalFrames=len(self.frameY)
 
-        f.close()
-
     ## handleHeader function
     # Interpreting the header of the file, containing width, height, frames per second and color space, assigning them to class variables
     def handleHeader(self):
@@ -96,7 +71,8 @@ class VideoPlayer:
             elif c=='H':
                 self.height=int(field[1:])
             elif c=='F':
-                self.fps=int(field[1:3])
+                fps=field[1:].split(':')
+                self.fps=Fraction(int(fps[0]),int(fps[1]) if len(fps)>1 else 1)
             elif c=='C':
                 self.colorSpace=int(field[1:])
                     